@@ -0,0 +1,30 @@
+import sqlite3
+
+def add_payment_idempotency_key():
+    """Adiciona payment.idempotency_key e o índice único das cobranças pendentes por compra"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA table_info(payment)")
+    columns = {row[1] for row in cursor.fetchall()}
+    
+    if 'idempotency_key' not in columns:
+        cursor.execute('ALTER TABLE payment ADD COLUMN idempotency_key TEXT')
+        print("✓ Adicionada coluna 'idempotency_key'")
+    else:
+        print("✓ Coluna 'idempotency_key' já existe")
+    
+    # Pagamentos antigos ficam sem chave (NULL não entra no índice)
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_pending_idempotency
+        ON payment(user_id, idempotency_key)
+        WHERE status = 'pending' AND idempotency_key IS NOT NULL
+    ''')
+    print("✓ Índice 'idx_payment_pending_idempotency' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_payment_idempotency_key()
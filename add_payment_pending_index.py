@@ -0,0 +1,19 @@
+import sqlite3
+
+def add_payment_pending_index():
+    """Cria índice parcial dos pagamentos pendentes usado pela conciliação em lote"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_pending_created_at
+        ON payment(created_at) WHERE status = 'pending'
+    ''')
+    print("✓ Índice 'idx_payment_pending_created_at' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_payment_pending_index()
@@ -0,0 +1,16 @@
+import sqlite3
+
+def add_payment_raffle_index():
+    """Cria índice (raffle_id, status, amount, expires_at) usado pelos totais do painel admin"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_payment_raffle_status ON payment(raffle_id, status, amount, expires_at)')
+    print("✓ Índice 'idx_payment_raffle_status' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_payment_raffle_index()
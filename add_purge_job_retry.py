@@ -0,0 +1,28 @@
+import sqlite3
+
+def add_purge_job_retry():
+    """Adiciona purge_job.attempts e purge_job.retry_at (nova tentativa com espera crescente)"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA table_info(purge_job)")
+    columns = {row[1] for row in cursor.fetchall()}
+    
+    if 'attempts' not in columns:
+        cursor.execute('ALTER TABLE purge_job ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        print("✓ Adicionada coluna 'attempts'")
+    else:
+        print("✓ Coluna 'attempts' já existe")
+    
+    if 'retry_at' not in columns:
+        cursor.execute('ALTER TABLE purge_job ADD COLUMN retry_at TIMESTAMP')
+        print("✓ Adicionada coluna 'retry_at'")
+    else:
+        print("✓ Coluna 'retry_at' já existe")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_purge_job_retry()
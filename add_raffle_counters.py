@@ -0,0 +1,29 @@
+import sqlite3
+
+def add_raffle_counters():
+    """Adiciona contadores sold_count/reserved_count à tabela raffle, mantidos por triggers"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    # Verificar se as colunas já existem
+    cursor.execute("PRAGMA table_info(raffle)")
+    columns = {row[1] for row in cursor.fetchall()}
+    
+    for column in ('sold_count', 'reserved_count'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE raffle ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+            print(f"✓ Adicionada coluna '{column}'")
+        else:
+            print(f"✓ Coluna '{column}' já existe")
+    
+    # Triggers + recálculo dos contadores
+    with open('migrations/add_raffle_counters.sql', 'r', encoding='utf-8') as f:
+        cursor.executescript(f.read())
+    print("✓ Triggers criados e contadores recalculados")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_raffle_counters()
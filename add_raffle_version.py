@@ -0,0 +1,27 @@
+import sqlite3
+
+def add_raffle_version():
+    """Adiciona coluna version à tabela raffle e triggers que a incrementam"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    # Verificar se a coluna já existe
+    cursor.execute("PRAGMA table_info(raffle)")
+    columns = {row[1] for row in cursor.fetchall()}
+    
+    if 'version' not in columns:
+        cursor.execute('ALTER TABLE raffle ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        print("✓ Adicionada coluna 'version'")
+    else:
+        print("✓ Coluna 'version' já existe")
+    
+    with open('migrations/add_raffle_version.sql', 'r', encoding='utf-8') as f:
+        cursor.executescript(f.read())
+    print("✓ Triggers de versão criados")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_raffle_version()
@@ -0,0 +1,37 @@
+import sqlite3
+
+def add_ticket_expires_at():
+    """Adiciona coluna expires_at (fim da reserva) à tabela ticket, com índice para a varredura"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    # Verificar se a coluna já existe
+    cursor.execute("PRAGMA table_info(ticket)")
+    columns = {row[1] for row in cursor.fetchall()}
+    
+    if 'expires_at' not in columns:
+        cursor.execute('ALTER TABLE ticket ADD COLUMN expires_at TIMESTAMP')
+        print("✓ Adicionada coluna 'expires_at'")
+    else:
+        print("✓ Coluna 'expires_at' já existe")
+    
+    # Reservas pendentes existentes: 1 hora a partir da criação (regra antiga)
+    cursor.execute('''
+        UPDATE ticket
+        SET expires_at = datetime(COALESCE(created_at, purchase_date), '+1 hour')
+        WHERE payment_status = 'pending' AND expires_at IS NULL
+    ''')
+    print(f"✓ {cursor.rowcount} reservas pendentes atualizadas")
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ticket_pending_expires_at
+        ON ticket(expires_at) WHERE payment_status = 'pending'
+    ''')
+    print("✓ Índice 'idx_ticket_pending_expires_at' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_ticket_expires_at()
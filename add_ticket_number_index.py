@@ -0,0 +1,16 @@
+import sqlite3
+
+def add_ticket_number_index():
+    """Cria índice (raffle_id, number) usado pela grade paginada de números"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ticket_raffle_number ON ticket(raffle_id, number)')
+    print("✓ Índice 'idx_ticket_raffle_number' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_ticket_number_index()
@@ -0,0 +1,33 @@
+import sqlite3
+
+def add_ticket_number_unique_index():
+    """Troca o índice (raffle_id, number) por um índice único: nenhum número vendido duas vezes"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    # Verificar números duplicados antes de criar o índice
+    cursor.execute('''
+        SELECT raffle_id, number, COUNT(*) FROM ticket
+        WHERE number IS NOT NULL
+        GROUP BY raffle_id, number
+        HAVING COUNT(*) > 1
+    ''')
+    duplicates = cursor.fetchall()
+    
+    if duplicates:
+        print("❌ Existem números duplicados; resolva-os antes de aplicar a migração:")
+        for raffle_id, number, count in duplicates:
+            print(f"  - Rifa {raffle_id}, número {number}: {count} bilhetes")
+        conn.close()
+        return
+    
+    cursor.execute('DROP INDEX IF EXISTS idx_ticket_raffle_number')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_ticket_raffle_number_unique ON ticket(raffle_id, number)')
+    print("✓ Índice único 'idx_ticket_raffle_number_unique' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_ticket_number_unique_index()
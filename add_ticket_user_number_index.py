@@ -0,0 +1,20 @@
+import sqlite3
+
+def add_ticket_user_number_index():
+    """Cria índice (user_id, raffle_id, número) usado pelo dashboard paginado"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ticket_user_raffle_number ON ticket(user_id, raffle_id, COALESCE(number, 0))')
+    print("✓ Índice 'idx_ticket_user_raffle_number' criado")
+    
+    # O índice antigo (user_id, raffle_id) é prefixo do novo
+    cursor.execute('DROP INDEX IF EXISTS idx_ticket_user_raffle')
+    print("✓ Índice 'idx_ticket_user_raffle' removido")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    add_ticket_user_number_index()
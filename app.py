@@ -1,14 +1,27 @@
 import os
-from flask import Flask, render_template, redirect, url_for, flash, request, g, current_app, session, jsonify
+from flask import Flask, render_template, redirect, url_for, flash, request, g, current_app, session, jsonify, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import database
-import random
+import background
+import draw
+import expiry
+import payments
+import payment_events
+import webhook_inbox
+import payment_provider
+import purge
+from availability import NumberIndex, ENCODERS, load_taken, reserve_numbers
+from cache import TTLCache
+import secrets
 import sqlite3
+import base64
+import json
+import time
 from datetime import datetime
-from efi_service import efi_service
+from payment_provider import get_payment_provider
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -16,20 +29,84 @@ load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev_key')
 app.config['DATABASE'] = os.path.join(app.root_path, 'rifamaster.db')
+app.config['DATABASE_WAL'] = os.getenv('DATABASE_WAL', 'true').lower() == 'true'
+app.config['DATABASE_SYNCHRONOUS'] = os.getenv('DATABASE_SYNCHRONOUS', 'NORMAL')
+app.config['DATABASE_BUSY_TIMEOUT'] = int(os.getenv('DATABASE_BUSY_TIMEOUT', 5000))  # ms
+app.config['DATABASE_MMAP_SIZE'] = int(os.getenv('DATABASE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['DATABASE_CACHE_SIZE'] = int(os.getenv('DATABASE_CACHE_SIZE', -20000))  # negativo = KiB
+app.config['DATABASE_REUSE_CONNECTIONS'] = os.getenv('DATABASE_REUSE_CONNECTIONS', 'true').lower() == 'true'
+app.config['DATABASE_AUTO_VACUUM'] = os.getenv('DATABASE_AUTO_VACUUM', 'INCREMENTAL')
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static/uploads')
+app.config['PAYMENT_PROVIDER'] = os.getenv('PAYMENT_PROVIDER', 'efi')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
+app.config['NUMBER_GRID_PAGE_SIZE'] = int(os.getenv('NUMBER_GRID_PAGE_SIZE', 500))
+app.config['NUMBER_GRID_MAX_PAGE_SIZE'] = int(os.getenv('NUMBER_GRID_MAX_PAGE_SIZE', 5000))
+app.config['DASHBOARD_PAGE_SIZE'] = int(os.getenv('DASHBOARD_PAGE_SIZE', 200))  # blocos por rifa
+app.config['DASHBOARD_TICKET_WINDOW'] = int(os.getenv('DASHBOARD_TICKET_WINDOW', 2000))  # bilhetes lidos por página de blocos
+app.config['DASHBOARD_RAFFLE_PAGE_SIZE'] = int(os.getenv('DASHBOARD_RAFFLE_PAGE_SIZE', 20))  # rifas por página do dashboard
+app.config['ADMIN_PAGE_SIZE'] = int(os.getenv('ADMIN_PAGE_SIZE', 50))  # rifas por página do painel
+app.config['PAGE_CACHE_TTL'] = int(os.getenv('PAGE_CACHE_TTL', 300))  # segundos
+app.config['PAGE_CACHE_MAX_ENTRIES'] = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', 512))
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))  # segundos
+app.config['USER_CACHE_MAX_ENTRIES'] = int(os.getenv('USER_CACHE_MAX_ENTRIES', 1024))
+app.config['BACKGROUND_JOBS_ENABLED'] = os.getenv('BACKGROUND_JOBS_ENABLED', 'true').lower() == 'true'
+app.config['RESERVATION_HOLD_MINUTES'] = int(os.getenv('RESERVATION_HOLD_MINUTES', 60))
+app.config['EXPIRY_SWEEP_INTERVAL'] = int(os.getenv('EXPIRY_SWEEP_INTERVAL', 60))  # segundos
+app.config['EXPIRY_SWEEP_BATCH'] = int(os.getenv('EXPIRY_SWEEP_BATCH', 500))
+app.config['EXPIRY_SWEEP_MAX_BATCHES'] = int(os.getenv('EXPIRY_SWEEP_MAX_BATCHES', 20))
+app.config['RECONCILE_INTERVAL'] = int(os.getenv('RECONCILE_INTERVAL', 30))  # segundos
+app.config['RECONCILE_WINDOW_MINUTES'] = int(os.getenv('RECONCILE_WINDOW_MINUTES', 120))
+app.config['RECONCILE_PAGE_SIZE'] = int(os.getenv('RECONCILE_PAGE_SIZE', 1000))
+app.config['PAYMENT_STATUS_CACHE_TTL'] = int(os.getenv('PAYMENT_STATUS_CACHE_TTL', 3))  # segundos
+app.config['PAYMENT_EVENTS_POLL_INTERVAL'] = float(os.getenv('PAYMENT_EVENTS_POLL_INTERVAL', 2))  # segundos
+app.config['PAYMENT_EVENTS_TIMEOUT'] = int(os.getenv('PAYMENT_EVENTS_TIMEOUT', 120))  # o navegador reconecta
+app.config['WEBHOOK_INBOX_INTERVAL'] = int(os.getenv('WEBHOOK_INBOX_INTERVAL', 10))  # segundos (o webhook acorda o job)
+app.config['WEBHOOK_INBOX_BATCH'] = int(os.getenv('WEBHOOK_INBOX_BATCH', 100))
+app.config['WEBHOOK_INBOX_MAX_BATCHES'] = int(os.getenv('WEBHOOK_INBOX_MAX_BATCHES', 50))
+app.config['WEBHOOK_INBOX_RETENTION_DAYS'] = int(os.getenv('WEBHOOK_INBOX_RETENTION_DAYS', 7))
+app.config['PURGE_INTERVAL'] = int(os.getenv('PURGE_INTERVAL', 60))  # segundos (a rota acorda o job)
+app.config['PURGE_BATCH'] = int(os.getenv('PURGE_BATCH', 500))
+app.config['PURGE_BATCH_PAUSE'] = float(os.getenv('PURGE_BATCH_PAUSE', 0.05))  # segundos entre lotes
+app.config['PURGE_VACUUM'] = os.getenv('PURGE_VACUUM', 'incremental')  # none, incremental ou full
+app.config['PURGE_MAX_ATTEMPTS'] = int(os.getenv('PURGE_MAX_ATTEMPTS', 5))
+app.config['PURGE_RETRY_BACKOFF'] = int(os.getenv('PURGE_RETRY_BACKOFF', 60))  # segundos, dobra a cada falha
 
 # Configuração para subpath (nginx proxy)
 # app.config['APPLICATION_ROOT'] = os.getenv('APPLICATION_ROOT', '/')
 # app.config['APPLICATION_ROOT'] = '/Rifa'
-# Garantir que pasta de uploads existe
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 
 
 # Inicializar DB
 database.init_app(app)
 
+# Provedor PIX (criado só no primeiro uso)
+payment_provider.init_app(app)
+
+# Jobs de fundo (expiração de reservas, conciliação de pagamentos, fila do webhook, exclusão de rifas)
+background.init_app(app)
+expiry.init_app(app)
+payments.init_app(app)
+webhook_inbox.init_app(app)
+purge.init_app(app)
+
+# Sorteio (comando de auditoria verify-draw)
+draw.init_app(app)
+
+# Cache de fragmentos HTML das páginas públicas (chave inclui raffle.version)
+page_cache = TTLCache(
+    max_entries=app.config['PAGE_CACHE_MAX_ENTRIES'],
+    ttl=app.config['PAGE_CACHE_TTL']
+)
+
+# Cache dos usuários logados (load_user roda em todo request, inclusive no polling)
+# Por processo: as rotas que alteram o usuário invalidam a entrada; nos outros
+# workers a entrada antiga vale no máximo USER_CACHE_TTL segundos
+user_cache = TTLCache(
+    max_entries=app.config['USER_CACHE_MAX_ENTRIES'],
+    ttl=app.config['USER_CACHE_TTL']
+)
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, faça login para acessar essa página.'
@@ -51,12 +128,17 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    db = database.get_db()
-    user_data = db.execute('SELECT * FROM user WHERE id = ?', (user_id,)).fetchone()
-    if user_data:
+    # Guarda só os campos (um User novo por request: nada compartilhado entre threads)
+    fields = user_cache.get(str(user_id))
+    if fields is None:
+        db = database.get_db()
+        user_data = db.execute('SELECT * FROM user WHERE id = ?', (user_id,)).fetchone()
+        if not user_data:
+            return None
+
         # sqlite3.Row does not support .get(), use keys directly or dict() conversion
         # Since we migrated, columns should exist. If they are NULL, we get None.
-        return User(
+        fields = (
             user_data['id'], 
             user_data['username'], 
             user_data['email'], 
@@ -68,7 +150,12 @@ def load_user(user_id):
             user_data['address'] if 'address' in user_data.keys() else None,
             user_data['cpf'] if 'cpf' in user_data.keys() else None
         )
-    return None
+        user_cache.set(str(user_id), fields)
+    return User(*fields)
+
+def invalidate_user(user_id):
+    """Descarta o usuário do cache após alterar a linha dele"""
+    user_cache.delete(str(user_id))
 
 # Context Processor
 @app.context_processor
@@ -165,16 +252,15 @@ def register():
             is_admin = True
             
         try:
-            db.execute(
+            cursor = db.execute(
                 'INSERT INTO user (username, email, password_hash, is_admin, cpf) VALUES (?, ?, ?, ?, ?)',
                 (username, email, hashed_password, is_admin, clean_cpf)
             )
             db.commit()
+            invalidate_user(cursor.lastrowid)
             
             # Login automático após registro
-            user_data = db.execute('SELECT * FROM user WHERE email = ?', (email,)).fetchone()
-            user = User(user_data['id'], user_data['username'], user_data['email'], user_data['password_hash'], user_data['is_admin'], user_data['cpf'])
-            login_user(user)
+            login_user(load_user(cursor.lastrowid))
             
             flash('Conta criada com sucesso! Por favor, complete seu perfil para poder receber prêmios.', 'success')
             return redirect(url_for('profile'))
@@ -215,6 +301,7 @@ def profile():
                 WHERE id = ?
             ''', (full_name, phone, pix_key, address, clean_cpf, current_user.id))
             db.commit()
+            invalidate_user(current_user.id)
             flash('Perfil atualizado com sucesso!', 'success')
             return redirect(url_for('profile'))
         except sqlite3.Error as e:
@@ -230,68 +317,183 @@ def logout():
     return redirect(url_for('index'))
 
 # --- Funções Auxiliares ---
-def get_current_price(raffle):
-    """Calcula o preço atual considerando promoções ativas"""
-    now = datetime.now()
-    if raffle['promo_price'] and raffle['promo_end']:
-        promo_end = raffle['promo_end']
-        
-        # If it's a string, try to parse it (legacy support or if converter fails)
-        if isinstance(promo_end, str):
+def get_promo_end(raffle):
+    """Retorna o fim da promoção como datetime (None se não houver ou for inválido)"""
+    if not (raffle['promo_price'] and raffle['promo_end']):
+        return None
+    
+    promo_end = raffle['promo_end']
+    
+    # If it's a string, try to parse it (legacy support or if converter fails)
+    if isinstance(promo_end, str):
+        try:
+            # Try parsing with seconds first (new format)
+            promo_end = datetime.strptime(promo_end, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
             try:
-                # Try parsing with seconds first (new format)
-                promo_end = datetime.strptime(promo_end, '%Y-%m-%d %H:%M:%S')
+                # Fallback to old format without seconds
+                promo_end = datetime.strptime(promo_end, '%Y-%m-%d %H:%M')
             except ValueError:
-                try:
-                    # Fallback to old format without seconds
-                    promo_end = datetime.strptime(promo_end, '%Y-%m-%d %H:%M')
-                except ValueError:
-                    return raffle['price'] # Invalid format
-
-        if isinstance(promo_end, datetime) and now < promo_end:
-            return raffle['promo_price']
+                return None # Invalid format
+    
+    return promo_end if isinstance(promo_end, datetime) else None
+
+def get_current_price(raffle):
+    """Calcula o preço atual considerando promoções ativas"""
+    promo_end = get_promo_end(raffle)
+    if promo_end and datetime.now() < promo_end:
+        return raffle['promo_price']
             
     return raffle['price']
 
+def render_cached_fragment(cache_key, raffles, template, build_context):
+    """
+    Renderiza um fragmento de página usando o cache.
+    A chave deve incluir a versão das rifas exibidas; a entrada também
+    expira quando alguma promoção exibida termina (o preço muda).
+    """
+    html = page_cache.get(cache_key)
+    if html is not None:
+        return html
+    
+    html = render_template(template, **build_context())
+    
+    ttl = current_app.config['PAGE_CACHE_TTL']
+    now = datetime.now()
+    for r in raffles:
+        promo_end = get_promo_end(r)
+        if promo_end and promo_end > now:
+            ttl = min(ttl, int((promo_end - now).total_seconds()) + 1)
+    
+    page_cache.set(cache_key, html, ttl=ttl)
+    return html
+
 # --- Rotas Principais ---
 
 @app.route('/')
 def index():
     db = database.get_db()
-    # Buscar rifas
-    raffles = db.execute("SELECT * FROM raffle WHERE status = 'active'").fetchall()
-    
-    # Processar dados para o template
-    raffles_data = []
-    for r in raffles:
-        r_dict = dict(r)
-        tickets_count = db.execute('SELECT COUNT(*) as count FROM ticket WHERE raffle_id = ? AND number IS NOT NULL', (r['id'],)).fetchone()['count']
-        r_dict['tickets_count'] = tickets_count
-        
-        # Verificar promoção ativa
-        r_dict['current_price'] = get_current_price(r_dict)
-        r_dict['is_promo'] = r_dict['current_price'] < r_dict['price']
+    # Versões das rifas ativas formam a chave do cache
+    versions = db.execute('''
+        SELECT id, version, promo_price, promo_end
+        FROM raffle WHERE status = 'active' ORDER BY id
+    ''').fetchall()
+    cache_key = ('index', tuple((r['id'], r['version']) for r in versions))
+    
+    def build_context():
+        # Buscar rifas (contagem de bilhetes vem dos contadores da própria rifa)
+        raffles = db.execute('''
+            SELECT *, sold_count + reserved_count as tickets_count
+            FROM raffle WHERE status = 'active' ORDER BY id
+        ''').fetchall()
         
-        raffles_data.append(r_dict)
+        # Processar dados para o template
+        raffles_data = []
+        for r in raffles:
+            r_dict = dict(r)
+            
+            # Verificar promoção ativa
+            r_dict['current_price'] = get_current_price(r_dict)
+            r_dict['is_promo'] = r_dict['current_price'] < r_dict['price']
+            
+            raffles_data.append(r_dict)
         
-    return render_template('index.html', raffles=raffles_data)
+        return {'raffles': raffles_data}
+    
+    raffle_list_html = render_cached_fragment(cache_key, versions, 'raffle_list.html', build_context)
+    return render_template('index.html', raffle_list_html=raffle_list_html)
 
 @app.route('/raffle/<int:raffle_id>')
 def raffle_detail(raffle_id):
     db = database.get_db()
     raffle = db.execute('SELECT * FROM raffle WHERE id = ?', (raffle_id,)).fetchone()
     
-    if not raffle:
+    # Rifa sendo excluída em segundo plano já some para o público
+    if not raffle or raffle['status'] == 'deleting':
         return "Rifa não encontrada", 404
+    
+    def build_context():
+        # Índice de disponibilidade da primeira janela da grade (o resto vem via raffle_numbers)
+        page_size = min(raffle['total_numbers'], current_app.config['NUMBER_GRID_PAGE_SIZE'])
+        availability = NumberIndex.load(db, raffle_id, 1, page_size)
+        
+        raffle_dict = dict(raffle)
+        raffle_dict['available_count'] = raffle['total_numbers'] - raffle['sold_count'] - raffle['reserved_count']
+        raffle_dict['current_price'] = get_current_price(raffle_dict)
+        raffle_dict['is_promo'] = raffle_dict['current_price'] < raffle_dict['price']
         
-    tickets = db.execute('SELECT * FROM ticket WHERE raffle_id = ? AND number IS NOT NULL', (raffle_id,)).fetchall()
+        return {'raffle': raffle_dict, 'availability': availability}
+    
+    cache_key = ('raffle_detail', raffle_id, raffle['version'])
+    raffle_body_html = render_cached_fragment(cache_key, [raffle], 'raffle_detail_body.html', build_context)
+    return render_template('raffle_detail.html', raffle_body_html=raffle_body_html)
+
+@app.route('/raffle/<int:raffle_id>/numbers')
+def raffle_numbers(raffle_id):
+    """Retorna o estado de uma janela de números da rifa (grade paginada)"""
+    db = database.get_db()
+    raffle = db.execute('SELECT total_numbers, status FROM raffle WHERE id = ?', (raffle_id,)).fetchone()
+    
+    if not raffle or raffle['status'] == 'deleting':
+        return jsonify({'success': False, 'error': 'Rifa não encontrada'}), 404
+    
+    total = raffle['total_numbers']
+    max_limit = current_app.config['NUMBER_GRID_MAX_PAGE_SIZE']
+    limit = request.args.get('limit', current_app.config['NUMBER_GRID_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, max_limit))
+    
+    # Aceita offset (0-based) ou page (1-based)
+    page = request.args.get('page', type=int)
+    if page is not None:
+        offset = (max(page, 1) - 1) * limit
+    else:
+        offset = max(0, request.args.get('offset', 0, type=int))
+    
+    count = max(0, min(limit, total - offset))
+    index = NumberIndex.load(db, raffle_id, offset + 1, count)
+    
+    # states: um dígito por número (0 = livre, 1 = reservado, 2 = vendido)
+    return jsonify({
+        'success': True,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'first': offset + 1,
+        'states': index.digits(),
+        'next_offset': offset + count if offset + count < total else None
+    })
+
+@app.route('/raffle/<int:raffle_id>/numbers/map')
+def raffle_numbers_map(raffle_id):
+    """Retorna o mapa completo de números da rifa em formato compacto (rle ou bitset)"""
+    encoding = request.args.get('format', 'rle')
+    if encoding not in ENCODERS:
+        return jsonify({'success': False, 'error': 'Formato inválido'}), 400
+    
+    db = database.get_db()
+    raffle = db.execute('SELECT total_numbers, version, status FROM raffle WHERE id = ?', (raffle_id,)).fetchone()
     
-    raffle_dict = dict(raffle)
-    raffle_dict['tickets'] = tickets
-    raffle_dict['current_price'] = get_current_price(raffle_dict)
-    raffle_dict['is_promo'] = raffle_dict['current_price'] < raffle_dict['price']
+    if not raffle or raffle['status'] == 'deleting':
+        return jsonify({'success': False, 'error': 'Rifa não encontrada'}), 404
     
-    return render_template('raffle_detail.html', raffle=raffle_dict)
+    # A versão da rifa muda a cada alteração de bilhete: 304 sem montar o mapa
+    etag = f"{encoding}-{raffle_id}-{raffle['version']}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        total = raffle['total_numbers']
+        data = ENCODERS[encoding](load_taken(db, raffle_id), total)
+        response = jsonify({
+            'success': True,
+            'total': total,
+            'encoding': encoding,
+            'version': raffle['version'],
+            'data': base64.b64encode(data).decode('ascii')
+        })
+    
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/raffle/<int:raffle_id>/buy', methods=['POST'])
 @login_required
@@ -307,33 +509,41 @@ def buy_ticket(raffle_id):
     
     if raffle_type == 'manual':
         # Manual: criar tickets imediatamente (números específicos escolhidos)
-        numbers = [int(n) for n in request.form.getlist('numbers')]
+        try:
+            numbers = sorted({int(n) for n in request.form.getlist('numbers')})
+        except ValueError:
+            numbers = []
         if not numbers:
             flash('Selecione pelo menos um número.', 'error')
             return redirect(url_for('raffle_detail', raffle_id=raffle_id))
-            
-        # Verificar disponibilidade
-        for num in numbers:
-            existing = db.execute('SELECT id FROM ticket WHERE raffle_id = ? AND number = ?', (raffle_id, num)).fetchone()
-            if existing:
-                flash(f'O número {num} já foi vendido.', 'error')
-                return redirect(url_for('raffle_detail', raffle_id=raffle_id))
         
-        # Criar bilhetes pendentes para manual
-        ticket_ids = []
+        if numbers[0] < 1 or numbers[-1] > raffle['total_numbers']:
+            flash('Número inválido para esta rifa.', 'error')
+            return redirect(url_for('raffle_detail', raffle_id=raffle_id))
+        
+        # Verificar disponibilidade e criar bilhetes pendentes em uma única transação
         try:
-            for num in numbers:
-                cursor = db.execute(
-                    'INSERT INTO ticket (user_id, raffle_id, number, status, created_at) VALUES (?, ?, ?, ?, datetime("now"))',
-                    (current_user.id, raffle_id, num, 'pending')
+            with database.immediate_transaction(db):
+                ticket_ids, conflicts = reserve_numbers(
+                    db, raffle_id, current_user.id, numbers,
+                    hold_minutes=current_app.config['RESERVATION_HOLD_MINUTES']
                 )
-                ticket_ids.append(cursor.lastrowid)
-            db.commit()
+        except sqlite3.IntegrityError:
+            # Índice único (raffle_id, number): outro comprador levou algum número
+            ticket_ids, conflicts = [], []
         except sqlite3.Error as e:
-            db.rollback()
             flash(f'Erro ao comprar bilhetes: {e}', 'error')
             return redirect(url_for('raffle_detail', raffle_id=raffle_id))
         
+        if not ticket_ids:
+            if len(conflicts) == 1:
+                flash(f'O número {conflicts[0]} já foi vendido.', 'error')
+            elif conflicts:
+                flash(f'Os números {", ".join(str(n) for n in conflicts)} já foram vendidos.', 'error')
+            else:
+                flash('Alguns números acabaram de ser vendidos. Tente novamente.', 'error')
+            return redirect(url_for('raffle_detail', raffle_id=raffle_id))
+        
         # Manual usa URL com ticket_ids (números já escolhidos)
         return redirect(url_for('checkout', ticket_ids=','.join([str(id) for id in ticket_ids])))
     
@@ -345,8 +555,7 @@ def buy_ticket(raffle_id):
             return redirect(url_for('raffle_detail', raffle_id=raffle_id))
             
         # Verificar se há números suficientes disponíveis
-        sold_count = db.execute('SELECT COUNT(*) as count FROM ticket WHERE raffle_id = ? AND number IS NOT NULL', (raffle_id,)).fetchone()['count']
-        available_count = raffle['total_numbers'] - sold_count
+        available_count = raffle['total_numbers'] - raffle['sold_count'] - raffle['reserved_count']
         
         if available_count < quantity:
             flash(f'Apenas {available_count} números disponíveis.', 'error')
@@ -360,7 +569,8 @@ def buy_ticket(raffle_id):
             'quantity': quantity,
             'price': float(raffle['price']),
             'promo_price': float(raffle['promo_price']) if raffle['promo_price'] else None,
-            'promo_end': raffle['promo_end']
+            'promo_end': raffle['promo_end'],
+            'checkout_key': secrets.token_urlsafe(16)  # idempotência da cobrança desta compra
         }
         
         # Redirecionar para checkout SEM ticket_ids na URL
@@ -446,7 +656,8 @@ def checkout():
             'number': None  # Fazendinha não tem número ainda
         }] * purchase['quantity']
         
-        return render_template('checkout.html', tickets=tickets_dicts, total_price=total_price, ticket_ids='', from_session=True)
+        return render_template('checkout.html', tickets=tickets_dicts, total_price=total_price, ticket_ids='', from_session=True,
+                               checkout_key=purchase.get('checkout_key', ''))
     
     else:
         # Sem dados válidos
@@ -456,7 +667,10 @@ def checkout():
 @app.route('/create_pix_payment', methods=['POST'])
 @login_required
 def create_pix_payment():
-    """Cria uma cobrança PIX via Efí e retorna QR Code"""
+    """
+    Cria uma cobrança PIX via Efí e retorna QR Code
+    Idempotente por compra: se a mesma compra já tem cobrança válida, devolve ela
+    """
     db = database.get_db()
     
     # Obter dados do checkout
@@ -469,9 +683,20 @@ def create_pix_payment():
         raffle_title = None
         total_amount = 0
         
-        if from_session and 'pending_purchase' in session:
+        purchase = session.get('pending_purchase') if from_session else None
+        checkout_key = request.form.get('checkout_key') or (purchase or {}).get('checkout_key')
+        
+        if from_session and checkout_key:
+            # Duplo clique / nova tentativa (a sessão já pode ter sido limpa pela primeira)
+            idempotency_key = payments.checkout_idempotency_key(checkout_key)
+            live_charge = payments.find_live_charge(db, current_user.id, idempotency_key)
+            if live_charge:
+                session.pop('pending_purchase', None)
+                return pix_charge_response(live_charge)
+        
+        if purchase:
             # --- FAZENDINHA: Apenas calcular valor, tickets serão criados no webhook ---
-            purchase = session['pending_purchase']
+            idempotency_key = payments.checkout_idempotency_key(checkout_key) if checkout_key else None
             raffle_id = purchase['raffle_id']
             raffle_title = purchase['raffle_title']
             quantity = purchase['quantity']
@@ -482,7 +707,7 @@ def create_pix_payment():
                 return jsonify({'success': False, 'error': 'Rifa indisponível'}), 400
             
             # Verificar se há números suficientes (sem reservar ainda)
-            used_count = db.execute('SELECT COUNT(*) as count FROM ticket WHERE raffle_id = ?', (raffle_id,)).fetchone()['count']
+            used_count = raffle['sold_count'] + raffle['reserved_count']
             if (raffle['total_numbers'] - used_count) < quantity:
                 return jsonify({'success': False, 'error': 'Não há números suficientes disponíveis'}), 400
             
@@ -495,9 +720,6 @@ def create_pix_payment():
             effective_price = get_current_price(raffle_data)
             total_amount = effective_price * quantity
             
-            # Limpar sessão
-            session.pop('pending_purchase', None)
-            
             tickets_data = {
                 'quantity': quantity,
                 'type': 'fazendinha'
@@ -521,6 +743,13 @@ def create_pix_payment():
             if not tickets:
                 return jsonify({'success': False, 'error': 'Bilhetes não encontrados'}), 404
             
+            # Mesmo conjunto de bilhetes com cobrança válida: devolver a mesma
+            ticket_ids = [t['id'] for t in tickets]
+            idempotency_key = payments.tickets_idempotency_key(ticket_ids)
+            live_charge = payments.find_live_charge(db, current_user.id, idempotency_key)
+            if live_charge:
+                return pix_charge_response(live_charge)
+            
             raffle_id = tickets[0]['raffle_id']
             raffle_title = tickets[0]['raffle_title']
             
@@ -544,135 +773,149 @@ def create_pix_payment():
         if not current_user.cpf:
             return jsonify({'success': False, 'error': 'CPF obrigatório para pagamento PIX. Por favor, atualize seu perfil.'}), 400
 
-        # Criar cobrança PIX via Efí
-        result = efi_service.create_pix_charge(
-            amount=total_amount,
-            raffle_title=raffle_title,
-            raffle_id=raffle_id,
-            user_id=current_user.id,
-            tickets_data=tickets_data,
-            cpf=current_user.cpf
+        # Reservar a compra antes de chamar a Efí: requisições simultâneas da mesma compra
+        # esperam a cobrança da primeira em vez de criar outra (que ficaria viva e solta)
+        claim = payments.claim_charge(
+            db, current_user.id, raffle_id, total_amount,
+            quantity if purchase else len(ticket_ids),
+            'fazendinha' if purchase else 'manual',
+            idempotency_key
         )
+        if claim['state'] == 'live':
+            session.pop('pending_purchase', None)
+            return pix_charge_response(claim['charge'])
+        if claim['state'] == 'busy':
+            live_charge = payments.wait_for_charge(db, current_user.id, idempotency_key)
+            if not live_charge:
+                return jsonify({'success': False, 'error': 'Pagamento em processamento. Tente novamente.'}), 409
+            session.pop('pending_purchase', None)
+            return pix_charge_response(live_charge)
+
+        # Criar cobrança PIX via Efí (com o txid da reserva)
+        try:
+            result = get_payment_provider().create_pix_charge(
+                amount=total_amount,
+                raffle_title=raffle_title,
+                raffle_id=raffle_id,
+                user_id=current_user.id,
+                tickets_data=tickets_data,
+                cpf=current_user.cpf,
+                txid=claim['txid']
+            )
+        except Exception:
+            payments.abandon_charge(db, claim['txid'])
+            raise
         
-        if result['success']:
-            # Registrar intenção de pagamento
-            db.execute('''
-                INSERT INTO payment (txid, user_id, raffle_id, amount, ticket_count, type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                result['txid'], 
-                current_user.id, 
-                raffle_id, 
-                total_amount, 
-                quantity if from_session else len(ticket_ids),
-                'fazendinha' if from_session else 'manual'
-            ))
-            
-            # Se for manual, vincular tickets ao txid
-            if not from_session:
-                for tid in ticket_ids:
-                    db.execute('UPDATE ticket SET payment_txid = ? WHERE id = ?', (result['txid'], tid))
-            
-            db.commit()
-            
         if not result['success']:
-            # Se falhar e for fazendinha, talvez devêssemos deletar os tickets? 
-            # Por enquanto deixamos como pending (vão expirar/ficar abandonados)
+            payments.abandon_charge(db, claim['txid'])
             return jsonify(result), 400
         
-        # Atualizar tickets com txid e dados do PIX
-        for ticket_id in ticket_ids:
-            db.execute('''
-                UPDATE ticket 
-                SET payment_txid = ?, payment_status = 'pending', 
-                    pix_qrcode = ?, pix_copy_paste = ?, 
-                    payment_expiration = ?
-                WHERE id = ?
-            ''', (result['txid'], result['qr_code'], result['copy_paste'], 
-                  result['expiration'], ticket_id))
-        db.commit()
+        # Registrar o payload PIX (guardado uma vez, no pagamento) e vincular os bilhetes manuais
+        payments.complete_charge(db, claim['txid'], result, ticket_ids)
         
-        return jsonify(result)
+        session.pop('pending_purchase', None)
+        return pix_charge_response(result)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def process_successful_payment(txid):
-    """Processa o pagamento confirmado: atualiza status e gera tickets se necessário"""
-    db = database.get_db()
-    payment = db.execute('SELECT * FROM payment WHERE txid = ?', (txid,)).fetchone()
-    
-    if not payment or payment['status'] == 'paid':
-        return
-
-    # Atualizar pagamento
-    db.execute('UPDATE payment SET status = "paid", updated_at = CURRENT_TIMESTAMP WHERE id = ?', (payment['id'],))
-    
-    if payment['type'] == 'manual':
-        # Atualizar tickets existentes
-        db.execute('''
-            UPDATE ticket 
-            SET payment_status = 'paid', status = 'paid', paid_at = CURRENT_TIMESTAMP
-            WHERE payment_txid = ?
-        ''', (txid,))
-        
-    elif payment['type'] == 'fazendinha':
-        # Gerar tickets agora
-        raffle_id = payment['raffle_id']
-        quantity = payment['ticket_count']
-        user_id = payment['user_id']
-        
-        raffle = db.execute('SELECT total_numbers FROM raffle WHERE id = ?', (raffle_id,)).fetchone()
-        used_numbers_rows = db.execute('SELECT number FROM ticket WHERE raffle_id = ? AND number IS NOT NULL', (raffle_id,)).fetchall()
-        used_numbers = {row['number'] for row in used_numbers_rows}
-        
-        available = [n for n in range(1, raffle['total_numbers'] + 1) if n not in used_numbers]
-        
-        if len(available) >= quantity:
-            selected_numbers = random.sample(available, quantity)
-            effective_price = payment['amount'] / quantity
-            
-            for number in selected_numbers:
-                db.execute('''
-                    INSERT INTO ticket (user_id, raffle_id, number, status, payment_status, total_price, payment_txid, paid_at)
-                    VALUES (?, ?, ?, 'paid', 'paid', ?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, raffle_id, number, effective_price, txid))
-    
-    db.commit()
+def pix_charge_response(charge):
+    """Resposta JSON da cobrança com a URL do QR Code (gerado sob demanda)"""
+    charge['qr_code'] = url_for('payment_qrcode', txid=charge['txid'])
+    return jsonify(charge)
 
 @app.route('/check_payment_status/<txid>', methods=['GET'])
 @login_required
 def check_payment_status(txid):
-    """Consulta status de pagamento PIX"""
+    """Consulta status de pagamento PIX (banco local primeiro; Efí só se ainda pendente)"""
     try:
-        result = efi_service.check_payment_status(txid)
-        
-        if result.get('success') and result.get('status') == 'paid':
-            process_successful_payment(txid)
-            
+        result = payments.lookup_payment_status(txid, cache_ttl=app.config['PAYMENT_STATUS_CACHE_TTL'])
         return jsonify(result)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/payment/<txid>/qrcode.svg')
+@login_required
+def payment_qrcode(txid):
+    """QR Code do PIX, gerado sob demanda a partir do payload salvo no pagamento"""
+    db = database.get_db()
+    payment = db.execute('SELECT user_id, pix_copy_paste FROM payment WHERE txid = ?', (txid,)).fetchone()
+    if not payment or not payment['pix_copy_paste'] or (payment['user_id'] != current_user.id and not current_user.is_admin):
+        return jsonify({'success': False, 'error': 'Pagamento não encontrado'}), 404
+
+    if request.if_none_match.contains(txid):
+        return Response(status=304)
+
+    response = Response(payments.pix_qr_svg(txid, payment['pix_copy_paste']), mimetype='image/svg+xml')
+    response.set_etag(txid)
+    response.cache_control.private = True
+    response.cache_control.max_age = 900
+    return response
+
+@app.route('/payment_events/<txid>')
+@login_required
+def payment_events_stream(txid):
+    """
+    Canal SSE do status do pagamento: envia o status atual e espera a mudança
+    (avisada pelo webhook/conciliador), sem consultar a Efí.
+    Status final (pago, expirado, cancelado) termina com o evento `end`; no tempo
+    limite o stream só fecha e o navegador reconecta.
+    """
+    db = database.get_db()
+    payment = db.execute('SELECT user_id FROM payment WHERE txid = ?', (txid,)).fetchall()
+    if not payment or payment[0]['user_id'] != current_user.id:
+        return jsonify({'success': False, 'error': 'Pagamento não encontrado'}), 404
+
+    poll_interval = app.config['PAYMENT_EVENTS_POLL_INTERVAL']
+    deadline = time.monotonic() + app.config['PAYMENT_EVENTS_TIMEOUT']
+
+    def stream():
+        generation = payment_events.current()
+        last_status = None
+        yield 'retry: 3000\n\n'
+
+        while True:
+            # fetchall: não deixar leitura aberta (prenderia um snapshot antigo do WAL)
+            rows = database.get_db().execute('SELECT status FROM payment WHERE txid = ?', (txid,)).fetchall()
+            status = rows[0]['status'] if rows else 'cancelled'
+
+            if status != last_status:
+                yield f"event: status\ndata: {json.dumps({'txid': txid, 'status': status})}\n\n"
+                last_status = status
+
+            if status != 'pending':
+                yield f"event: end\ndata: {json.dumps({'txid': txid, 'status': status})}\n\n"
+                return
+            if time.monotonic() >= deadline:
+                return
+
+            new_generation = payment_events.wait(generation, poll_interval)
+            if new_generation == generation:
+                yield ': ping\n\n'  # detecta aba fechada
+            generation = new_generation
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx: não bufferizar o stream
+    })
+
 @app.route('/webhook/efi', methods=['POST'])
 def efi_webhook():
-    """Recebe notificações de pagamento da Efí"""
+    """Recebe notificações de pagamento da Efí (grava na fila e responde na hora)"""
     try:
         # Validar assinatura
         signature = request.headers.get('X-Efi-Signature', '')
         payload = request.get_data()
         
-        if not efi_service.validate_webhook(payload, signature):
+        if not get_payment_provider().validate_webhook(payload, signature):
             return jsonify({'error': 'Invalid signature'}), 401
         
         data = request.get_json()
         
-        # Processar notificação PIX
-        if 'pix' in data:
-            for pix in data.get('pix', []):
-                txid = pix.get('txid')
-                if txid:
-                    process_successful_payment(txid)
+        # Gravar as notificações PIX; a confirmação fica com o job da fila
+        received = webhook_inbox.enqueue(database.get_db(), data.get('pix', []))
+        if received:
+            webhook_inbox.wake_worker()
         
         return jsonify({'success': True}), 200
         
@@ -683,12 +926,16 @@ def efi_webhook():
 @app.route('/retry_payment/<int:ticket_id>', methods=['POST'])
 @login_required
 def retry_payment(ticket_id):
-    """Permite pagar um bilhete pendente"""
+    """
+    Permite pagar um bilhete pendente. A nova cobrança cobre todos os bilhetes ainda
+    reservados do mesmo pagamento (o bloco inteiro do dashboard), não só este.
+    """
     db = database.get_db()
     
     # Buscar bilhete
     ticket = db.execute('''
-        SELECT t.*, r.title as raffle_title, r.id as raffle_id, r.price, r.promo_price, r.promo_end
+        SELECT t.*, r.title as raffle_title, r.id as raffle_id, r.price, r.promo_price, r.promo_end,
+               t.expires_at <= datetime('now') as expired
         FROM ticket t
         JOIN raffle r ON t.raffle_id = r.id
         WHERE t.id = ? AND t.user_id = ?
@@ -700,146 +947,265 @@ def retry_payment(ticket_id):
     if ticket['payment_status'] != 'pending':
         return jsonify({'success': False, 'error': 'Bilhete já foi pago'}), 400
     
-    # Verificar se não expirou (1 hora)
-    from datetime import datetime as dt, timedelta
-    
-    if not ticket['created_at']:
-        return jsonify({'success': False, 'error': 'Bilhete sem data de criação'}), 400
-    
-    if isinstance(ticket['created_at'], str):
-        created = dt.strptime(ticket['created_at'], '%Y-%m-%d %H:%M:%S')
-    else:
-        created = ticket['created_at']  # Já é datetime
-    
-    expiration = created + timedelta(hours=1)
-    if dt.utcnow() > expiration:  # SQLite usa UTC
-        # Deletar bilhete expirado
-        db.execute('DELETE FROM ticket WHERE id = ?', (ticket_id,))
-        db.commit()
+    # Verificar se a reserva não expirou (a liberação fica com o job de expiração)
+    if not ticket['expires_at'] or ticket['expired']:
         return jsonify({'success': False, 'error': 'Bilhete expirado'}), 400
     
     # Validar CPF
     if not current_user.cpf:
         return jsonify({'success': False, 'error': 'CPF obrigatório para pagamento PIX. Por favor, atualize seu perfil.'}), 400
     
+    # Cobrança anterior ainda válida: devolver a mesma em vez de criar outra
+    live_charge = payments.find_live_charge(db, current_user.id, txid=ticket['payment_txid'])
+    if live_charge:
+        return pix_charge_response(live_charge)
+    
+    # Bilhetes do mesmo pagamento ainda reservados: todos entram na nova cobrança
+    ticket_ids = [ticket_id]
+    if ticket['payment_txid']:
+        ticket_ids = [row['id'] for row in db.execute('''
+            SELECT id FROM ticket
+            WHERE payment_txid = ? AND user_id = ? AND payment_status = 'pending' AND expires_at > datetime('now')
+            ORDER BY id
+        ''', (ticket['payment_txid'], current_user.id))] or [ticket_id]
+    
     # Calcular preço
     raffle_data = {
         'price': ticket['price'],
         'promo_price': ticket['promo_price'],
         'promo_end': ticket['promo_end']
     }
-    amount = get_current_price(raffle_data)
-    
-    # Criar nova cobrança PIX
-    result = efi_service.create_pix_charge(
-        amount=amount,
-        raffle_title=ticket['raffle_title'],
-        raffle_id=ticket['raffle_id'],
-        user_id=current_user.id,
-        tickets_data={'ticket_ids': [ticket_id], 'type': 'manual'},
-        cpf=current_user.cpf
-    )
+    amount = get_current_price(raffle_data) * len(ticket_ids)
+    
+    # Nova cobrança pela reserva da compra (cliques repetidos recebem a mesma cobrança);
+    # o pagamento vencido fica como está e os bilhetes passam para o novo txid
+    idempotency_key = payments.tickets_idempotency_key(ticket_ids)
+    claim = payments.claim_charge(db, current_user.id, ticket['raffle_id'], amount, len(ticket_ids), 'manual', idempotency_key)
+    if claim['state'] == 'live':
+        return pix_charge_response(claim['charge'])
+    if claim['state'] == 'busy':
+        live_charge = payments.wait_for_charge(db, current_user.id, idempotency_key)
+        if not live_charge:
+            return jsonify({'success': False, 'error': 'Pagamento em processamento. Tente novamente.'}), 409
+        return pix_charge_response(live_charge)
     
-    if result['success']:
-        # Atualizar ticket com novo txid
-        db.execute('UPDATE ticket SET payment_txid = ? WHERE id = ?', (result['txid'], ticket_id))
-        db.commit()
-        
-        # Atualizar ou criar Payment record
-        existing_payment = db.execute('SELECT id FROM payment WHERE txid = ?', (ticket['payment_txid'],)).fetchone()
-        if existing_payment:
-            db.execute('UPDATE payment SET txid = ? WHERE id = ?', (result['txid'], existing_payment['id']))
-        else:
-            db.execute('''
-                INSERT INTO payment (txid, user_id, raffle_id, amount, ticket_count, type)
-                VALUES (?, ?, ?, ?, 1, 'manual')
-            ''', (result['txid'], current_user.id, ticket['raffle_id'], amount))
-        db.commit()
+    try:
+        result = get_payment_provider().create_pix_charge(
+            amount=amount,
+            raffle_title=ticket['raffle_title'],
+            raffle_id=ticket['raffle_id'],
+            user_id=current_user.id,
+            tickets_data={'ticket_ids': ticket_ids, 'type': 'manual'},
+            cpf=current_user.cpf,
+            txid=claim['txid']
+        )
+    except Exception:
+        payments.abandon_charge(db, claim['txid'])
+        raise
+    
+    if not result['success']:
+        payments.abandon_charge(db, claim['txid'])
+        return jsonify(result), 400
     
-    return jsonify(result)
+    payments.complete_charge(db, claim['txid'], result, ticket_ids)
+    return pix_charge_response(result)
+
+# Filtro comum do dashboard: reservas vencidas são liberadas pelo job de expiração, aqui só não aparecem
+VISIBLE_TICKET_FILTER = "t.user_id = ? AND NOT (t.payment_status = 'pending' AND t.expires_at <= datetime('now'))"
+
+# Status da rifa para exibição
+RAFFLE_STATUS_TEXT = {'active': 'Ativa', 'closed': 'Encerrada', 'deleting': 'Excluindo'}
+
+def visible_window_sql(where):
+    """
+    Janela de bilhetes visíveis de uma rifa: no máximo N bilhetes (último parâmetro) na ordem
+    do índice (user_id, raffle_id, número), nunca o histórico inteiro do usuário.
+    """
+    return f'''
+        SELECT * FROM (
+            SELECT t.id, t.raffle_id, t.number, t.status, t.payment_status, t.payment_txid,
+                   COALESCE(t.number, 0) AS position_number,
+                   CAST((julianday(t.expires_at) - julianday('now')) * 86400 AS INTEGER) AS seconds_remaining
+            FROM ticket t
+            WHERE {where}
+            ORDER BY COALESCE(t.number, 0), t.id
+            LIMIT ?
+        )
+    '''
+
+def ticket_blocks_sql(visible):
+    """
+    CTEs que agrupam os bilhetes visíveis em blocos de números consecutivos do mesmo pagamento
+    (gaps-and-islands: número - ROW_NUMBER() é constante dentro de uma sequência).
+    `visible` é uma ou mais janelas de visible_window_sql (UNION ALL, uma por rifa).
+    O resultado `blocks` tem uma linha por bloco, com número inicial/final e quantidade.
+    """
+    return f'''
+        WITH visible AS ({visible}),
+        islands AS (
+            SELECT *, position_number - ROW_NUMBER() OVER (
+                       PARTITION BY raffle_id, payment_txid, payment_status, status
+                       ORDER BY position_number, id
+                   ) AS island
+            FROM visible
+        ),
+        blocks AS (
+            SELECT raffle_id, payment_txid, payment_status, status,
+                   MIN(number) AS number, MAX(number) AS last_number, COUNT(*) AS count,
+                   MIN(position_number) AS first_position, MAX(position_number) AS last_position,
+                   MIN(id) AS id, MAX(id) AS last_id, MIN(seconds_remaining) AS seconds_remaining
+            FROM islands
+            GROUP BY raffle_id, payment_txid, payment_status, status, island
+        )
+    '''
+
+def ticket_view(row):
+    """Campos de um bilhete usados pela grade do dashboard"""
+    time_remaining = None
+    if row['payment_status'] == 'pending' and row['seconds_remaining'] is not None:
+        time_remaining = max(0, row['seconds_remaining'])
+
+    return {
+        'number': row['number'],
+        'status': row['status'] or 'paid',
+        'payment_status': row['payment_status'] or 'paid',
+        'id': row['id'],
+        'payment_txid': row['payment_txid'],
+        'time_remaining': time_remaining
+    }
+
+def block_view(row):
+    """Bloco de números consecutivos; um bloco de 1 número é exibido como bilhete comum"""
+    block = ticket_view(row)
+    block.update({
+        'last_number': row['last_number'],
+        'count': row['count'],
+        'cursor': f"{row['last_position']}:{row['last_id']}"
+    })
+    return block
+
+def load_block_page(db, user_id, raffle_id, after=(0, 0), limit=None):
+    """
+    Página de blocos do usuário em uma rifa, depois do cursor (número, id).
+    Retorna (blocos, próximo cursor ou None).
+    """
+    limit = limit or current_app.config['DASHBOARD_PAGE_SIZE']
+    window = current_app.config['DASHBOARD_TICKET_WINDOW']
+    where = (VISIBLE_TICKET_FILTER + ' AND t.raffle_id = ?'
+             ' AND COALESCE(t.number, 0) >= ? AND (COALESCE(t.number, 0), t.id) > (?, ?)')
+    rows = db.execute(ticket_blocks_sql(visible_window_sql(where)) + '''
+        SELECT *, (SELECT COUNT(*) FROM visible) AS window_count
+        FROM blocks ORDER BY first_position, id LIMIT ?
+    ''', (user_id, raffle_id, after[0], after[0], after[1], window, limit + 1)).fetchall()
+    
+    window_full = bool(rows) and rows[0]['window_count'] == window
+    return block_page(rows, limit, window_full)
+
+def block_page(rows, limit, window_full):
+    """
+    Corta as linhas de blocos (em ordem) em uma página: (blocos, próximo cursor ou None).
+    Com a janela cheia, o último bloco pode continuar além dela e fica para a próxima página
+    (um bloco maior que a janela inteira é exibido em partes).
+    """
+    blocks = [block_view(row) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    if not has_more and window_full:
+        has_more = True
+        if len(blocks) > 1:
+            blocks.pop()
+    
+    return blocks, (blocks[-1]['cursor'] if has_more else None)
+
+def ticket_cursor(ticket):
+    """Cursor da paginação por chave: (número, id) do último bilhete da página"""
+    return f"{ticket['number'] or 0}:{ticket['id']}"
+
+def parse_ticket_cursor(value):
+    try:
+        number, ticket_id = value.split(':')
+        return int(number), int(ticket_id)
+    except (AttributeError, ValueError):
+        return None
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
     db = database.get_db()
     
-    # Limpar bilhetes pendentes expirados (mais de 1 hora)
-    db.execute('''
-        DELETE FROM ticket 
-        WHERE payment_status = 'pending' 
-        AND datetime(purchase_date, '+1 hour') < datetime('now')
-    ''')
-    db.commit()
-    
-    query = '''
-        SELECT t.*, r.title as raffle_title, r.status as raffle_status, r.winner_ticket_id, r.image_url
-        FROM ticket t
-        JOIN raffle r ON t.raffle_id = r.id
-        WHERE t.user_id = ?
-        ORDER BY r.title ASC, t.number ASC
-    '''
-    tickets = db.execute(query, (current_user.id,)).fetchall()
-    
-    # Mapeamento de tradução de status
-    status_map = {'active': 'Ativa', 'closed': 'Encerrada'}
+    page_size = current_app.config['DASHBOARD_RAFFLE_PAGE_SIZE']
+    after = request.args.get('after', type=int)
+    
+    # Rifas do usuário: busca solta no índice (user_id, raffle_id, número), um salto por rifa em
+    # vez de ler o histórico; paginadas por chave (título, id) a partir da rifa `after`
+    keyset = ''
+    params = [current_user.id, current_user.id, current_user.id]
+    if after:
+        keyset = 'WHERE (r.title, r.id) > ((SELECT title FROM raffle WHERE id = ?), ?)'
+        params += [after, after]
+    raffles = db.execute(f'''
+        WITH RECURSIVE user_raffle(id) AS (
+            SELECT MIN(raffle_id) FROM ticket WHERE user_id = ?
+            UNION ALL
+            SELECT (SELECT MIN(raffle_id) FROM ticket WHERE user_id = ? AND raffle_id > user_raffle.id)
+            FROM user_raffle WHERE user_raffle.id IS NOT NULL
+        )
+        SELECT r.id, r.title, r.status, r.winner_ticket_id, r.image_url,
+               w.number AS winning_number, w.user_id = ? AS is_winner
+        FROM user_raffle u
+        JOIN raffle r ON r.id = u.id
+        LEFT JOIN ticket w ON w.id = r.winner_ticket_id
+        {keyset}
+        ORDER BY r.title ASC, r.id
+        LIMIT ?
+    ''', params + [page_size + 1]).fetchall()
+    
+    next_raffle = raffles[page_size - 1]['id'] if len(raffles) > page_size else None
+    raffles = raffles[:page_size]
     
     try:
-        from datetime import datetime as dt, timedelta
-        
-        # Agrupar tickets por rifa
         grouped_tickets = {}
-        for t in tickets:
-            # Converter Row para dict para usar .get() com segurança
-            t_dict = dict(t)
-            
-            raffle_title = t_dict['raffle_title']
-            if raffle_title not in grouped_tickets:
-                # Se houver vencedor, buscar o número vencedor
-                winning_number = None
-                if t_dict.get('winner_ticket_id'):
-                    wt = db.execute('SELECT number FROM ticket WHERE id = ?', (t_dict['winner_ticket_id'],)).fetchone()
-                    if wt:
-                        winning_number = wt['number']
-
-                grouped_tickets[raffle_title] = {
-                    'raffle_id': t_dict['raffle_id'],
-                    'raffle_status': t_dict['raffle_status'],
-                    'raffle_status_text': status_map.get(t_dict['raffle_status'], t_dict['raffle_status']),
-                    'winner_ticket_id': t_dict.get('winner_ticket_id'),
-                    'winning_number': winning_number,
-                    'image_url': t_dict.get('image_url'),
-                    'tickets': []
-                }
-            
-            # Calcular tempo restante para bilhetes pendentes
-            time_remaining = None
-            payment_status = t_dict.get('payment_status', 'paid')  # Default para compatibilidade
+        if raffles:
+            # Só as rifas desta página: uma contagem agrupada e uma única consulta com a primeira
+            # janela de blocos de cada rifa (uma janela limitada por rifa, unidas com UNION ALL)
+            raffle_ids = [raffle['id'] for raffle in raffles]
+            placeholders = ','.join('?' * len(raffle_ids))
+            counts = dict(db.execute(f'''
+                SELECT t.raffle_id, COUNT(*) FROM ticket t
+                WHERE {VISIBLE_TICKET_FILTER} AND t.raffle_id IN ({placeholders})
+                GROUP BY t.raffle_id
+            ''', [current_user.id] + raffle_ids).fetchall())
             
-            if payment_status == 'pending' and t_dict.get('created_at'):
-                try:
-                    # SQLite pode retornar string ou datetime
-                    if isinstance(t_dict['created_at'], str):
-                        created = dt.strptime(t_dict['created_at'], '%Y-%m-%d %H:%M:%S')
-                    else:
-                        created = t_dict['created_at']  # Já é datetime
-                    expiration = created + timedelta(hours=1)
-                    now = dt.utcnow()  # SQLite usa UTC por padrão
-                    remaining = (expiration - now).total_seconds()
-                    time_remaining = max(0, int(remaining))
-                except Exception as e:
-                    print(f"Erro ao calcular tempo restante para ticket {t_dict.get('id')}: {e}")
-                    time_remaining = 0
+            window = current_app.config['DASHBOARD_TICKET_WINDOW']
+            windows = ' UNION ALL '.join(
+                [visible_window_sql(VISIBLE_TICKET_FILTER + ' AND t.raffle_id = ?')] * len(raffle_ids))
+            window_params = [param for raffle_id in raffle_ids for param in (current_user.id, raffle_id, window)]
+            block_rows = {}
+            for row in db.execute(ticket_blocks_sql(windows) + '''
+                SELECT * FROM blocks ORDER BY raffle_id, first_position, id
+            ''', window_params):
+                block_rows.setdefault(row['raffle_id'], []).append(row)
+        
+        for raffle in raffles:
+            if not counts.get(raffle['id']):
+                continue  # só reservas vencidas, ainda não liberadas pelo job
             
-            grouped_tickets[raffle_title]['tickets'].append({
-                'number': t_dict.get('number'),
-                'status': t_dict.get('status', 'paid'),
-                'payment_status': payment_status,
-                'id': t_dict.get('id'),
-                'payment_txid': t_dict.get('payment_txid'),
-                'time_remaining': time_remaining
-            })
-
-        return render_template('dashboard.html', grouped_tickets=grouped_tickets)
+            rows = block_rows.get(raffle['id'], [])
+            window_full = sum(row['count'] for row in rows) == window
+            blocks, next_cursor = block_page(rows, current_app.config['DASHBOARD_PAGE_SIZE'], window_full)
+            grouped_tickets[raffle['title']] = {
+                'raffle_id': raffle['id'],
+                'raffle_status': raffle['status'],
+                'raffle_status_text': RAFFLE_STATUS_TEXT.get(raffle['status'], raffle['status']),
+                'winner_ticket_id': raffle['winner_ticket_id'],
+                'winning_number': raffle['winning_number'],
+                'is_winner': bool(raffle['is_winner']),
+                'image_url': raffle['image_url'],
+                'ticket_count': counts[raffle['id']],
+                'blocks': blocks,
+                'next_cursor': next_cursor
+            }
+
+        return render_template('dashboard.html', grouped_tickets=grouped_tickets, next_raffle=next_raffle)
     except Exception as e:
         print(f"Erro no dashboard: {e}")
         import traceback
@@ -847,6 +1213,78 @@ def dashboard():
         flash('Erro ao carregar seus bilhetes. Por favor, contate o suporte.', 'error')
         return render_template('dashboard.html', grouped_tickets={})
 
+def load_winning_number(db, raffle_id):
+    row = db.execute('''
+        SELECT w.number FROM raffle r JOIN ticket w ON w.id = r.winner_ticket_id WHERE r.id = ?
+    ''', (raffle_id,)).fetchone()
+    return row['number'] if row else None
+
+@app.route('/dashboard/raffle/<int:raffle_id>/blocks')
+@login_required
+def dashboard_blocks(raffle_id):
+    """Próxima página de blocos do usuário em uma rifa (paginação por chave: ?after=número:id)"""
+    after = parse_ticket_cursor(request.args.get('after', '0:0'))
+    if after is None:
+        return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
+    
+    limit = request.args.get('limit', current_app.config['DASHBOARD_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['DASHBOARD_PAGE_SIZE']))
+    
+    db = database.get_db()
+    # Começar depois do último bloco já exibido mantém os blocos seguintes intactos
+    blocks, next_cursor = load_block_page(db, current_user.id, raffle_id, after, limit)
+    
+    return jsonify({
+        'success': True,
+        'count': len(blocks),
+        'html': render_template('dashboard_blocks.html', blocks=blocks, raffle_id=raffle_id,
+                                winning_number=load_winning_number(db, raffle_id)),
+        'next_cursor': next_cursor
+    })
+
+@app.route('/dashboard/raffle/<int:raffle_id>/tickets')
+@login_required
+def dashboard_tickets(raffle_id):
+    """
+    Bilhetes individuais do usuário em uma rifa (paginação por chave: ?after=número:id).
+    Com ?until=número, lista só até esse número (expansão de um bloco).
+    """
+    after = parse_ticket_cursor(request.args.get('after', '0:0'))
+    if after is None:
+        return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
+    
+    limit = request.args.get('limit', current_app.config['DASHBOARD_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['DASHBOARD_PAGE_SIZE']))
+    until = request.args.get('until', type=int)
+    
+    params = [current_user.id, raffle_id, after[0], after[0], after[1]]
+    until_filter = ''
+    if until is not None:
+        until_filter = 'AND COALESCE(t.number, 0) <= ?'
+        params.append(until)
+    
+    db = database.get_db()
+    rows = db.execute(f'''
+        SELECT t.id, t.number, t.status, t.payment_status, t.payment_txid,
+               CAST((julianday(t.expires_at) - julianday('now')) * 86400 AS INTEGER) AS seconds_remaining
+        FROM ticket t
+        WHERE {VISIBLE_TICKET_FILTER} AND t.raffle_id = ?
+          AND COALESCE(t.number, 0) >= ? AND (COALESCE(t.number, 0), t.id) > (?, ?)
+          {until_filter}
+        ORDER BY COALESCE(t.number, 0), t.id
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+    
+    tickets = [ticket_view(row) for row in rows[:limit]]
+    
+    return jsonify({
+        'success': True,
+        'count': len(tickets),
+        'html': render_template('dashboard_tickets.html', tickets=tickets,
+                                winning_number=load_winning_number(db, raffle_id)),
+        'next_cursor': ticket_cursor(tickets[-1]) if len(rows) > limit else None
+    })
+
 # --- Rotas de Admin ---
 
 @app.route('/admin')
@@ -856,26 +1294,94 @@ def admin_panel():
         flash('Acesso não autorizado.', 'error')
         return redirect(url_for('index'))
         
-    db = database.get_db()
-    raffles_raw = db.execute('SELECT * FROM raffle').fetchall()
+    status_filter = request.args.get('status')
+    if status_filter not in RAFFLE_STATUS_TEXT:
+        status_filter = None
+    # Paginação por chave nos dois sentidos: ?before=<id> (mais antigas) e ?after=<id> (mais recentes)
+    before = request.args.get('before', type=int)
+    after = None if before else request.args.get('after', type=int)
+    page_size = current_app.config['ADMIN_PAGE_SIZE']
+    
+    filters = []
+    params = []
+    if status_filter:
+        filters.append('status = ?')
+        params.append(status_filter)
+    if before:
+        filters.append('id < ?')
+        params.append(before)
+    if after:
+        filters.append('id > ?')
+        params.append(after)
+    where = ('WHERE ' + ' AND '.join(filters)) if filters else ''
+    # Voltando (?after=): as mais antigas logo acima do cursor, depois na ordem normal
+    page_order = 'ASC' if after else 'DESC'
     
-    # Mapeamento de tradução de status
-    status_map = {'active': 'Ativa', 'closed': 'Encerrada'}
+    db = database.get_db()
+    # Uma consulta: página de rifas (mais novas primeiro, paginação por chave) + totais de
+    # pagamentos por rifa (GROUP BY só sobre as rifas da página, coberto pelo índice)
+    # tickets_count = TODOS os tickets (paid + pending), como a validação de delete conta:
+    # os contadores só têm os numerados; os sem número (reservas aleatórias antigas) vêm
+    # do índice (raffle_id, number), onde ficam juntos no início da faixa da rifa
+    raffles_raw = db.execute(f'''
+        WITH page AS (
+            SELECT * FROM raffle {where} ORDER BY id {page_order} LIMIT ?
+        ),
+        totals AS (
+            SELECT raffle_id,
+                   SUM(status = 'paid') AS paid_payments,
+                   SUM(status = 'pending' AND (expires_at IS NULL OR expires_at > datetime('now'))) AS pending_payments,
+                   SUM(CASE WHEN status = 'paid' THEN amount ELSE 0 END) AS revenue
+            FROM payment
+            WHERE raffle_id IN (SELECT id FROM page)
+            GROUP BY raffle_id
+        )
+        SELECT page.*,
+               page.sold_count + page.reserved_count
+                   + (SELECT COUNT(*) FROM ticket WHERE raffle_id = page.id AND number IS NULL) AS tickets_count,
+               COALESCE(totals.paid_payments, 0) AS paid_payments,
+               COALESCE(totals.pending_payments, 0) AS pending_payments,
+               COALESCE(totals.revenue, 0) AS revenue
+        FROM page
+        LEFT JOIN totals ON totals.raffle_id = page.id
+        ORDER BY page.id {page_order}
+    ''', params + [page_size + 1]).fetchall()
+    
+    has_more = len(raffles_raw) > page_size
+    page_rows = raffles_raw[:page_size]
+    if after:
+        page_rows.reverse()
     
-    # Adicionar contagem de tickets para cada rifa
     raffles_data = []
-    for raffle in raffles_raw:
+    for raffle in page_rows:
         raffle_dict = dict(raffle)
-        # Contar TODOS os tickets (paid + pending) para validação de delete
-        tickets_count = db.execute(
-            'SELECT COUNT(*) as count FROM ticket WHERE raffle_id = ?', 
-            (raffle['id'],)
-        ).fetchone()['count']
-        raffle_dict['tickets_count'] = tickets_count
-        raffle_dict['status_text'] = status_map.get(raffle['status'], raffle['status'])
+        raffle_dict['status_text'] = RAFFLE_STATUS_TEXT.get(raffle['status'], raffle['status'])
         raffles_data.append(raffle_dict)
     
-    return render_template('admin_panel.html', raffles=raffles_data)
+    # Voltando, sempre há mais antigas (a página de onde se veio); indo, sempre há mais recentes
+    next_before = prev_after = None
+    if raffles_data:
+        if has_more or after:
+            next_before = raffles_data[-1]['id']
+        if before or (after and has_more):
+            prev_after = raffles_data[0]['id']
+    
+    # Exclusões em andamento (barra de progresso no topo do painel)
+    purge_jobs = [
+        purge.job_progress(job)
+        for job in db.execute("SELECT * FROM purge_job WHERE status IN ('pending', 'running', 'failed') ORDER BY id").fetchall()
+    ]
+    
+    return render_template('admin_panel.html', raffles=raffles_data, status_filter=status_filter,
+                           status_options=RAFFLE_STATUS_TEXT, next_before=next_before, prev_after=prev_after,
+                           purge_jobs=purge_jobs)
+
+def save_upload(file):
+    """Salva o arquivo enviado em UPLOAD_FOLDER (criada no primeiro upload); retorna o nome"""
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    filename = secure_filename(file.filename)
+    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    return filename
 
 @app.route('/admin/create_raffle', methods=['POST'])
 @login_required
@@ -910,8 +1416,7 @@ def create_raffle():
     if 'image_file' in request.files:
         file = request.files['image_file']
         if file and file.filename != '':
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            filename = save_upload(file)
             image_url = url_for('static', filename=f'uploads/{filename}')
 
     db = database.get_db()
@@ -954,8 +1459,7 @@ def edit_raffle(raffle_id):
     if 'image_file' in request.files:
         file = request.files['image_file']
         if file and file.filename != '':
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            filename = save_upload(file)
             image_url = url_for('static', filename=f'uploads/{filename}')
             
     db = database.get_db()
@@ -992,11 +1496,12 @@ def create_admin_user():
     
     db = database.get_db()
     try:
-        db.execute(
+        cursor = db.execute(
             'INSERT INTO user (username, email, password_hash, is_admin) VALUES (?, ?, ?, ?)',
             (username, email, hashed_password, True)
         )
         db.commit()
+        invalidate_user(cursor.lastrowid)
         flash(f'Admin {username} criado com sucesso!', 'success')
     except sqlite3.Error:
         flash('Erro ao criar admin. Email pode já existir.', 'error')
@@ -1011,16 +1516,14 @@ def draw_winner(raffle_id):
         
     db = database.get_db()
     
-    sold_tickets = db.execute('SELECT * FROM ticket WHERE raffle_id = ? AND status = "paid" AND number IS NOT NULL', (raffle_id,)).fetchall()
+    # Contagem + bilhete da posição sorteada: memória constante, semente registrada em raffle_draw
+    result = draw.draw_winner(db, raffle_id, drawn_by=current_user.id)
     
-    if not sold_tickets:
-        flash('Não há bilhetes vendidos para realizar o sorteio.', 'error')
+    if not result['success']:
+        flash(result['error'], 'error')
         return redirect(url_for('admin_panel'))
-        
-    winner_ticket = random.choice(sold_tickets)
     
-    db.execute('UPDATE raffle SET status = "closed", winner_ticket_id = ? WHERE id = ?', (winner_ticket['id'], raffle_id))
-    db.commit()
+    winner_ticket = result['ticket']
     
     winner_user = db.execute('SELECT username FROM user WHERE id = ?', (winner_ticket['user_id'],)).fetchone()
     
@@ -1112,15 +1615,14 @@ def delete_raffle(raffle_id):
         flash('Não é possível deletar rifa com bilhetes vendidos.', 'error')
         return redirect(url_for('admin_panel'))
     
-    if raffle['status'] == 'closed':
+    if raffle['status'] != 'active':
         flash('Não é possível deletar rifa já encerrada.', 'error')
         return redirect(url_for('admin_panel'))
     
-    # Deletar rifa
-    db.execute('DELETE FROM raffle WHERE id = ?', (raffle_id,))
-    db.commit()
+    # Exclusão em segundo plano (a rifa sai do ar agora; os dados somem em lotes)
+    purge.enqueue_purge(db, raffle_id, created_by=current_user.id)
     
-    flash(f'Rifa "{raffle["title"]}" deletada com sucesso!', 'success')
+    flash(f'Rifa "{raffle["title"]}" sendo deletada. O progresso aparece no painel.', 'success')
     return redirect(url_for('admin_panel'))
 
 @app.route('/admin/delete_all_raffles', methods=['POST'])
@@ -1133,13 +1635,39 @@ def delete_all_raffles():
     
     db = database.get_db()
     
-    # Deletar tudo
-    db.execute('DELETE FROM ticket')
-    db.execute('DELETE FROM raffle')
-    db.execute('DELETE FROM payment') # Opcional: limpar pagamentos também para resetar total
-    db.commit()
+    # Marca todas as rifas e apaga bilhetes, pagamentos e sorteios em lotes no job de fundo
+    # (um DELETE único seguraria o lock de escrita por segundos e travaria as compras)
+    purge.enqueue_purge(db, created_by=current_user.id)
     
-    flash('TODAS as rifas e dados relacionados foram apagados com sucesso.', 'success')
+    flash('Exclusão de TODAS as rifas iniciada. O progresso aparece no painel.', 'success')
+    return redirect(url_for('admin_panel'))
+
+@app.route('/admin/purge/<int:job_id>')
+@login_required
+def purge_status(job_id):
+    """Progresso de uma exclusão em segundo plano (JSON)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    db = database.get_db()
+    job = db.execute('SELECT * FROM purge_job WHERE id = ?', (job_id,)).fetchone()
+    if not job:
+        return jsonify({'success': False, 'error': 'Exclusão não encontrada'}), 404
+    
+    return jsonify({'success': True, **purge.job_progress(job)})
+
+@app.route('/admin/purge/<int:job_id>/retry', methods=['POST'])
+@login_required
+def retry_purge(job_id):
+    """Devolve para a fila uma exclusão que esgotou as tentativas"""
+    if not current_user.is_admin:
+        flash('Acesso negado.', 'error')
+        return redirect(url_for('index'))
+    
+    if purge.retry_failed_jobs(database.get_db(), job_id):
+        flash('Exclusão de volta na fila.', 'success')
+    else:
+        flash('Esta exclusão não está com falha.', 'error')
     return redirect(url_for('admin_panel'))
 
 
@@ -1155,10 +1683,12 @@ def winner_details(raffle_id):
     # Buscar dados da rifa e do ganhador
     query = '''
         SELECT r.*, t.number as winning_number, t.purchase_date,
-               u.username, u.email, u.full_name, u.phone, u.cpf, u.pix_key, u.address
+               u.username, u.email, u.full_name, u.phone, u.cpf, u.pix_key, u.address,
+               d.seed AS draw_seed, d.ticket_count AS draw_ticket_count, d.draw_offset, d.drawn_at
         FROM raffle r
         LEFT JOIN ticket t ON r.winner_ticket_id = t.id
         LEFT JOIN user u ON t.user_id = u.id
+        LEFT JOIN raffle_draw d ON d.raffle_id = r.id
         WHERE r.id = ?
     '''
     result = db.execute(query, (raffle_id,)).fetchone()
@@ -1177,7 +1707,14 @@ def winner_details(raffle_id):
         'address': result['address'],
         'winning_number': result['winning_number'],
         'purchase_date': result['purchase_date'],
-        'raffle_price': float(result['price'])
+        'raffle_price': float(result['price']),
+        # Prova do sorteio (ausente em rifas sorteadas antes do registro)
+        'draw': {
+            'seed': result['draw_seed'],
+            'ticket_count': result['draw_ticket_count'],
+            'offset': result['draw_offset'],
+            'drawn_at': str(result['drawn_at'])
+        } if result['draw_seed'] else None
     })
 
 
@@ -0,0 +1,279 @@
+"""
+Índice de disponibilidade dos números de uma rifa
+Guarda o estado de cada número em um byte (livre / reservado / vendido)
+e gera o mapa completo em formato compacto para os clientes
+"""
+import bisect
+import random
+
+FREE = 0
+RESERVED = 1
+SOLD = 2
+
+STATUS_NAMES = ('available', 'reserved', 'sold')
+
+_DIGITS = bytes.maketrans(bytes([FREE, RESERVED, SOLD]), b'012')
+
+
+class NumberIndex:
+    """Mapa compacto número → estado para uma faixa contínua de números"""
+
+    def __init__(self, first, count):
+        self.first = first
+        self.count = max(0, count)
+        self.states = bytearray(self.count)
+        self.taken = 0
+
+    @classmethod
+    def load(cls, db, raffle_id, first, count):
+        """Monta o índice da faixa [first, first + count) com uma única consulta"""
+        index = cls(first, count)
+        rows = db.execute('''
+            SELECT number, status FROM ticket
+            WHERE raffle_id = ? AND number BETWEEN ? AND ?
+        ''', (raffle_id, first, first + index.count - 1)).fetchall()
+
+        for row in rows:
+            index.mark(row['number'], SOLD if row['status'] == 'paid' else RESERVED)
+
+        return index
+
+    def mark(self, number, state):
+        pos = number - self.first
+        if 0 <= pos < self.count:
+            if self.states[pos] == FREE and state != FREE:
+                self.taken += 1
+            self.states[pos] = state
+
+    def state(self, number):
+        """Estado numérico do número (FREE fora da faixa)"""
+        pos = number - self.first
+        if 0 <= pos < self.count:
+            return self.states[pos]
+        return FREE
+
+    def status(self, number):
+        """Nome do estado usado pelos templates ('available', 'reserved', 'sold')"""
+        return STATUS_NAMES[self.state(number)]
+
+    def digits(self):
+        """Estados como texto compacto, um dígito por número ('0', '1', '2')"""
+        return self.states.translate(_DIGITS).decode('ascii')
+
+    @property
+    def available(self):
+        return self.count - self.taken
+
+
+# ==========================================================
+# MAPA COMPACTO (cliente colore a grade localmente)
+# ==========================================================
+def load_taken(db, raffle_id):
+    """Números ocupados da rifa em ordem crescente: [(number, state), ...]"""
+    rows = db.execute('''
+        SELECT number, status FROM ticket
+        WHERE raffle_id = ? AND number IS NOT NULL
+        ORDER BY number
+    ''', (raffle_id,)).fetchall()
+    return [(row['number'], SOLD if row['status'] == 'paid' else RESERVED) for row in rows]
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_runs(taken, total):
+    """
+    Codifica o mapa como sequência de runs (varint de length << 2 | state).
+    O custo é proporcional aos números ocupados, não ao total da rifa.
+    """
+    out = bytearray()
+    run_state = FREE
+    run_length = 0
+    expected = 1
+
+    for number, state in taken:
+        if number < expected or number > total:
+            continue  # duplicado ou fora da faixa
+        gap = number - expected
+        if gap:
+            if run_state == FREE:
+                run_length += gap
+            else:
+                _write_varint(out, run_length << 2 | run_state)
+                run_state, run_length = FREE, gap
+        if state == run_state:
+            run_length += 1
+        else:
+            if run_length:
+                _write_varint(out, run_length << 2 | run_state)
+            run_state, run_length = state, 1
+        expected = number + 1
+
+    if expected <= total:
+        if run_state == FREE:
+            run_length += total - expected + 1
+        else:
+            _write_varint(out, run_length << 2 | run_state)
+            run_state, run_length = FREE, total - expected + 1
+    if run_length:
+        _write_varint(out, run_length << 2 | run_state)
+
+    return bytes(out)
+
+
+def encode_bitset(taken, total):
+    """Codifica o mapa com 2 bits por número (4 números por byte, número 1 nos bits baixos)"""
+    out = bytearray((total + 3) // 4)
+    for number, state in taken:
+        if 1 <= number <= total:
+            pos = number - 1
+            out[pos >> 2] |= state << ((pos & 3) * 2)
+    return bytes(out)
+
+
+ENCODERS = {
+    'rle': encode_runs,
+    'bitset': encode_bitset,
+}
+
+
+# ==========================================================
+# SORTEIO DE NÚMEROS LIVRES (fazendinha)
+# ==========================================================
+_IN_CHUNK = 500  # limite de parâmetros por consulta IN (...)
+_system_random = random.SystemRandom()
+
+
+def _select_in(db, sql, params, values):
+    """Executa `sql` (com {placeholders}) em lotes de valores para o IN (...)"""
+    values = list(values)
+    rows = []
+    for i in range(0, len(values), _IN_CHUNK):
+        chunk = values[i:i + _IN_CHUNK]
+        placeholders = ','.join(['?'] * len(chunk))
+        rows.extend(db.execute(sql.format(placeholders=placeholders), list(params) + chunk).fetchall())
+    return rows
+
+
+def taken_among(db, raffle_id, numbers):
+    """Subconjunto de `numbers` que já está ocupado na rifa"""
+    rows = _select_in(
+        db, 'SELECT number FROM ticket WHERE raffle_id = ? AND number IN ({placeholders})',
+        (raffle_id,), numbers
+    )
+    return {row['number'] for row in rows}
+
+
+def _free_intervals(db, raffle_id, total):
+    """Intervalos livres [(início, tamanho), ...] a partir dos números ocupados ordenados"""
+    intervals = []
+    expected = 1
+    for number, _state in load_taken(db, raffle_id):
+        if number > total:
+            break
+        if number > expected:
+            intervals.append((expected, number - expected))
+        expected = max(expected, number + 1)
+    if expected <= total:
+        intervals.append((expected, total - expected + 1))
+    return intervals
+
+
+_MAX_REJECTION_ROUNDS = 20
+
+
+def _sample_by_rejection(db, raffle_id, total, free, k, rng):
+    chosen = []
+    chosen_set = set()
+    for _round in range(_MAX_REJECTION_ROUNDS):
+        need = k - len(chosen)
+        # Sorteios em lote: ~need * total / free candidatos devem bastar
+        batch = int(need * total / free * 1.25) + 8
+        candidates = [rng.randint(1, total) for _ in range(batch)]
+        taken = taken_among(db, raffle_id, set(candidates) - chosen_set)
+
+        # Percorre na ordem sorteada: equivale a rejeitar um a um (uniforme)
+        for number in candidates:
+            if number in taken or number in chosen_set:
+                continue
+            chosen.append(number)
+            chosen_set.add(number)
+            if len(chosen) == k:
+                return chosen
+
+    return None  # contadores defasados: quem chamou recorre aos intervalos
+
+
+def _sample_by_intervals(db, raffle_id, total, free, k, rng):
+    intervals = _free_intervals(db, raffle_id, total)
+    starts = []  # posição (entre os livres) onde cada intervalo começa
+    acc = 0
+    for _start, length in intervals:
+        starts.append(acc)
+        acc += length
+
+    if acc < k:
+        return None
+
+    chosen = []
+    for position in rng.sample(range(acc), k):
+        i = bisect.bisect_right(starts, position) - 1
+        chosen.append(intervals[i][0] + position - starts[i])
+    return chosen
+
+
+def pick_free_numbers(db, raffle_id, total, taken_count, k, rng=None):
+    """
+    Sorteia k números livres distintos, com distribuição uniforme.
+
+    Com a rifa pouco ocupada usa amostragem por rejeição (custo ~ k, consultando
+    só os candidatos no índice); perto de lotar, sorteia posições entre os
+    intervalos livres (custo ~ números ocupados). Nunca percorre 1..total.
+    Deve rodar dentro de uma transação de escrita para não haver duplicados.
+    Retorna None se não houver números livres suficientes.
+    """
+    rng = rng or _system_random
+    free = total - taken_count
+    if k <= 0:
+        return []
+    if k > free:
+        return None
+
+    # Custo esperado da rejeição (k * total / free) vs. varrer os ocupados
+    if taken_count and k * total / free < taken_count:
+        chosen = _sample_by_rejection(db, raffle_id, total, free, k, rng)
+        if chosen is not None:
+            return chosen
+    return _sample_by_intervals(db, raffle_id, total, free, k, rng)
+
+
+# ==========================================================
+# RESERVA DE NÚMEROS ESCOLHIDOS (manual)
+# ==========================================================
+def reserve_numbers(db, raffle_id, user_id, numbers, hold_minutes=60):
+    """
+    Reserva os números escolhidos de uma vez: verifica todos com uma consulta
+    e insere em lote. Deve rodar em transação de escrita (BEGIN IMMEDIATE);
+    o índice único (raffle_id, number) garante que nada seja vendido duas vezes.
+    A reserva vale por `hold_minutes` (ticket.expires_at).
+    Retorna (ticket_ids, conflitos) — se houver conflitos, nada é inserido.
+    """
+    conflicts = sorted(taken_among(db, raffle_id, numbers))
+    if conflicts:
+        return [], conflicts
+
+    hold = f'+{int(hold_minutes)} minutes'
+    db.executemany('''
+        INSERT INTO ticket (user_id, raffle_id, number, status, created_at, expires_at)
+        VALUES (?, ?, ?, 'pending', datetime('now'), datetime('now', ?))
+    ''', [(user_id, raffle_id, number, hold) for number in numbers])
+
+    rows = _select_in(
+        db, 'SELECT id FROM ticket WHERE raffle_id = ? AND number IN ({placeholders}) ORDER BY number',
+        (raffle_id,), numbers
+    )
+    return [row['id'] for row in rows], []
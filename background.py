@@ -0,0 +1,101 @@
+"""
+Tarefas periódicas em threads de fundo (uma por processo/worker)
+Os jobs são registrados na inicialização e iniciados no primeiro request,
+assim comandos de CLI (init-db, migrações) não disparam threads.
+"""
+import os
+import socket
+import threading
+import traceback
+
+import database
+
+
+class PeriodicJob:
+    """Executa `func` a cada `interval` segundos dentro do app context"""
+
+    def __init__(self, app, name, interval, func):
+        self.app = app
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'job-{self.name}', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Antecipa a próxima execução (ex.: chegou trabalho novo)"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.func()
+            except Exception as e:
+                print(f"Erro no job '{self.name}': {e}")
+                traceback.print_exc()
+
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+
+_jobs = {}
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def register_job(app, name, interval, func):
+    """Registra um job periódico; retorna o PeriodicJob (para chamar wake())"""
+    job = PeriodicJob(app, name, interval, func)
+    _jobs[name] = job
+    return job
+
+
+def get_job(name):
+    return _jobs.get(name)
+
+
+def claim_lease(name, duration):
+    """
+    Arrendamento no banco para jobs que não podem rodar em todos os workers ao mesmo tempo.
+    Retorna True se este processo pegou (ou renovou) o job `name` por `duration` segundos;
+    False se outro processo ainda o detém.
+    """
+    holder = f'{socket.gethostname()}:{os.getpid()}'
+    db = database.get_db()
+    with database.immediate_transaction(db):
+        lease = db.execute('''
+            SELECT holder, expires_at > datetime('now') AS live FROM job_lease WHERE name = ?
+        ''', (name,)).fetchone()
+        if lease and lease['live'] and lease['holder'] != holder:
+            return False
+        db.execute('''
+            INSERT INTO job_lease (name, holder, expires_at) VALUES (?, ?, datetime('now', ?))
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+        ''', (name, holder, f'+{int(duration)} seconds'))
+    return True
+
+
+def start_jobs():
+    """Inicia os jobs registrados uma vez por processo (seguro após fork do gunicorn)"""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        for job in _jobs.values():
+            job.start()
+        _started_pid = os.getpid()
+
+
+def init_app(app):
+    @app.before_request
+    def _start_background_jobs():
+        if app.config.get('BACKGROUND_JOBS_ENABLED', True):
+            start_jobs()
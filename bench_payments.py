@@ -0,0 +1,208 @@
+"""
+Benchmark ponta a ponta do fluxo de pagamento:
+compra → checkout → create_pix_payment → webhook → confirmação (SSE)
+
+Precisa do app rodando apontado para o fake_efi_server.py e de uma rifa ativa
+com números suficientes. Exemplo:
+
+    python fake_efi_server.py --port 9000 --webhook-url http://127.0.0.1:5000/webhook/efi
+    EFI_BASE_URL=http://127.0.0.1:9000 EFI_SANDBOX_CLIENT_SECRET=fake_client_secret python app.py
+    python bench_payments.py --app-url http://127.0.0.1:5000 --efi-url http://127.0.0.1:9000 \\
+        --raffle-id 1 --concurrency 20 --purchases 200
+
+Relata throughput (compras confirmadas/s) e p50/p99 de cada etapa.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+STAGES = ('buy', 'checkout', 'create_pix', 'confirm', 'total')
+
+
+def random_cpf(rng):
+    """CPF aleatório válido (dígitos verificadores corretos)"""
+    digits = [rng.randint(0, 9) for _ in range(9)]
+    for length in (9, 10):
+        total = sum(d * (length + 1 - i) for i, d in enumerate(digits))
+        digits.append((total * 10) % 11 % 10)
+    return ''.join(map(str, digits))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Buyer:
+    """Um usuário virtual com a própria sessão (cookie de login)"""
+
+    def __init__(self, args, index, run_id):
+        self.args = args
+        self.http = requests.Session()
+        self.rng = random.Random(f'{run_id}-{index}')
+        self.email = f'bench-{run_id}-{index}@example.com'
+
+    def url(self, path):
+        return self.args.app_url.rstrip('/') + path
+
+    def register(self):
+        response = self.http.post(self.url('/register'), data={
+            'username': self.email.split('@')[0],
+            'email': self.email,
+            'password': 'bench',
+            'cpf': random_cpf(self.rng),
+        }, allow_redirects=False)
+        response.raise_for_status()
+        self.http.post(self.url('/login'), data={'email': self.email, 'password': 'bench'}, allow_redirects=False)
+
+    def buy(self):
+        """Compra e devolve o formulário do checkout; None se os números já tinham dono"""
+        if self.args.mode == 'manual':
+            numbers = self.rng.sample(range(1, self.args.total_numbers + 1), self.args.tickets)
+            data = {'numbers': [str(n) for n in numbers]}
+        else:
+            data = {'quantity': str(self.args.tickets)}
+
+        response = self.http.post(self.url(f'/raffle/{self.args.raffle_id}/buy'), data=data, allow_redirects=False)
+        location = response.headers.get('Location', '')
+        if response.status_code != 302 or '/checkout' not in location:
+            return None
+
+        match = re.search(r'ticket_ids=([0-9%2C,]+)', location)
+        ticket_ids = match.group(1).replace('%2C', ',') if match else ''
+        return location, {'ticket_ids': ticket_ids, 'from_session': 'false' if ticket_ids else 'true'}
+
+    def wait_paid(self, txid):
+        """Espera a confirmação pelo canal SSE, como o navegador"""
+        deadline = time.monotonic() + self.args.confirm_timeout
+        while time.monotonic() < deadline:
+            with self.http.get(self.url(f'/payment_events/{txid}'), stream=True, timeout=self.args.confirm_timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith('data:') and json.loads(line[5:])['status'] == 'paid':
+                        return True
+        return False
+
+    def purchase(self, stats):
+        timings = {}
+        start = time.perf_counter()
+
+        bought = self.buy()
+        timings['buy'] = time.perf_counter() - start
+        if not bought:
+            stats.record_conflict()
+            return
+
+        location, form = bought
+        t = time.perf_counter()
+        self.http.get(location if location.startswith('http') else self.url(location)).raise_for_status()
+        timings['checkout'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        result = self.http.post(self.url('/create_pix_payment'), data=form).json()
+        timings['create_pix'] = time.perf_counter() - t
+        if not result.get('success'):
+            stats.record_error(result.get('error'))
+            return
+
+        t = time.perf_counter()
+        if self.args.efi_url:
+            # Pagar a cobrança no fake (ele envia o webhook assinado para o app)
+            requests.post(f"{self.args.efi_url.rstrip('/')}/_fake/pay/{result['txid']}", timeout=10)
+        if not self.wait_paid(result['txid']):
+            stats.record_error('confirmação não chegou')
+            return
+        timings['confirm'] = time.perf_counter() - t
+        timings['total'] = time.perf_counter() - start
+
+        stats.record(timings)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {stage: [] for stage in STAGES}
+        self.completed = 0
+        self.conflicts = 0
+        self.errors = {}
+
+    def record(self, timings):
+        with self.lock:
+            self.completed += 1
+            for stage, value in timings.items():
+                self.samples[stage].append(value)
+
+    def record_conflict(self):
+        with self.lock:
+            self.conflicts += 1
+
+    def record_error(self, error):
+        with self.lock:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def report(self, elapsed):
+        print(f'\nCompras confirmadas: {self.completed} em {elapsed:.1f}s '
+              f'→ {self.completed / elapsed:.1f}/s')
+        print(f'Conflitos de número: {self.conflicts}   Erros: {sum(self.errors.values())}')
+        for error, count in self.errors.items():
+            print(f'  {count}x {error}')
+
+        print(f"\n{'etapa':<12}{'p50 (ms)':>10}{'p99 (ms)':>10}{'máx (ms)':>10}")
+        for stage in STAGES:
+            values = self.samples[stage]
+            print(f'{stage:<12}{percentile(values, .5) * 1000:>10.1f}'
+                  f'{percentile(values, .99) * 1000:>10.1f}{max(values, default=0) * 1000:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do fluxo de pagamento PIX')
+    parser.add_argument('--app-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--efi-url', default='http://127.0.0.1:9000',
+                        help='fake Efí (vazio: depende do --pay-after do fake)')
+    parser.add_argument('--raffle-id', type=int, required=True)
+    parser.add_argument('--mode', choices=('manual', 'fazendinha'), default='manual')
+    parser.add_argument('--total-numbers', type=int, default=10000, help='total_numbers da rifa (modo manual)')
+    parser.add_argument('--tickets', type=int, default=3, help='números por compra')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--purchases', type=int, default=100)
+    parser.add_argument('--confirm-timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    buyers = [Buyer(args, i, run_id) for i in range(args.concurrency)]
+    print(f'Registrando {len(buyers)} usuários...')
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(lambda buyer: buyer.register(), buyers))
+
+    stats = Stats()
+    counter = iter(range(args.purchases))
+    counter_lock = threading.Lock()
+
+    def worker(buyer):
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            try:
+                buyer.purchase(stats)
+            except requests.RequestException as e:
+                stats.record_error(type(e).__name__)
+
+    print(f'Executando {args.purchases} compras com concorrência {args.concurrency}...')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(worker, buyers))
+    stats.report(time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
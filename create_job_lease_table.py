@@ -0,0 +1,22 @@
+import sqlite3
+
+def create_job_lease_table():
+    """Cria a tabela job_lease (jobs que rodam em um só processo por intervalo)"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS job_lease (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at TIMESTAMP NOT NULL
+    )
+    ''')
+    print("✓ Tabela 'job_lease' criada")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    create_job_lease_table()
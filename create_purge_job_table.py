@@ -0,0 +1,44 @@
+import sqlite3
+
+def create_purge_job_table():
+    """Cria a tabela purge_job (exclusão de rifas em segundo plano) e ativa o auto_vacuum incremental"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS purge_job (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        raffle_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'pending',
+        tickets_total INTEGER NOT NULL DEFAULT 0,
+        payments_total INTEGER NOT NULL DEFAULT 0,
+        raffles_total INTEGER NOT NULL DEFAULT 0,
+        tickets_deleted INTEGER NOT NULL DEFAULT 0,
+        payments_deleted INTEGER NOT NULL DEFAULT 0,
+        raffles_deleted INTEGER NOT NULL DEFAULT 0,
+        draws_deleted INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        retry_at TIMESTAMP,
+        created_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (created_by) REFERENCES user (id)
+    )
+    ''')
+    print("✓ Tabela 'purge_job' criada")
+    conn.commit()
+    
+    # Em banco existente o auto_vacuum só muda com um VACUUM (rode com o app parado)
+    if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+        print("✓ auto_vacuum incremental ativado (VACUUM executado)")
+    
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    create_purge_job_table()
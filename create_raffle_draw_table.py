@@ -0,0 +1,37 @@
+import sqlite3
+
+def create_raffle_draw_table():
+    """Cria a tabela raffle_draw (prova do sorteio) e o índice parcial de bilhetes pagos"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS raffle_draw (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        raffle_id INTEGER UNIQUE NOT NULL,
+        ticket_id INTEGER NOT NULL,
+        number INTEGER NOT NULL,
+        ticket_count INTEGER NOT NULL,
+        draw_offset INTEGER NOT NULL,
+        seed TEXT NOT NULL,
+        drawn_by INTEGER,
+        drawn_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (raffle_id) REFERENCES raffle (id),
+        FOREIGN KEY (ticket_id) REFERENCES ticket (id),
+        FOREIGN KEY (drawn_by) REFERENCES user (id)
+    )
+    ''')
+    print("✓ Tabela 'raffle_draw' criada")
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ticket_paid_number
+        ON ticket(raffle_id, number) WHERE status = 'paid' AND number IS NOT NULL
+    ''')
+    print("✓ Índice 'idx_ticket_paid_number' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    create_raffle_draw_table()
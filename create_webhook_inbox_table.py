@@ -0,0 +1,34 @@
+import sqlite3
+
+def create_webhook_inbox_table():
+    """Cria a tabela webhook_inbox (fila durável das notificações da Efí)"""
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS webhook_inbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_key TEXT UNIQUE NOT NULL,
+        txid TEXT,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP
+    )
+    ''')
+    print("✓ Tabela 'webhook_inbox' criada")
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_webhook_inbox_pending
+        ON webhook_inbox(id) WHERE status = 'pending'
+    ''')
+    print("✓ Índice 'idx_webhook_inbox_pending' criado")
+    
+    conn.commit()
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    create_webhook_inbox_table()
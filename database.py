@@ -1,5 +1,8 @@
+import os
 import sqlite3
+import threading
 import click
+from contextlib import contextmanager
 from flask import current_app, g
 import datetime
 
@@ -28,22 +31,109 @@ def convert_timestamp(val):
 # Register the converter
 sqlite3.register_converter("TIMESTAMP", convert_timestamp)
 
+# Configuração padrão da conexão (sobrescrita por app.config)
+DEFAULTS = {
+    'DATABASE_WAL': True,                 # leitores não bloqueiam o escritor
+    'DATABASE_SYNCHRONOUS': 'NORMAL',     # seguro com WAL, menos fsync
+    'DATABASE_BUSY_TIMEOUT': 5000,        # ms esperando o lock de escrita
+    'DATABASE_MMAP_SIZE': 256 * 1024 * 1024,
+    'DATABASE_CACHE_SIZE': -20000,        # negativo = KiB (~20MB por conexão)
+    'DATABASE_REUSE_CONNECTIONS': True,   # uma conexão por thread do worker
+    'DATABASE_AUTO_VACUUM': 'INCREMENTAL', # páginas livres voltam ao disco via incremental_vacuum
+}
+
+_local = threading.local()
+
+def _config(key):
+    return current_app.config.get(key, DEFAULTS[key])
+
+def _connect():
+    busy_timeout = int(_config('DATABASE_BUSY_TIMEOUT'))
+    db = sqlite3.connect(
+        current_app.config['DATABASE'],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        timeout=busy_timeout / 1000
+    )
+    db.row_factory = sqlite3.Row
+
+    # Precisa vir antes do WAL: só tem efeito em banco novo (nos existentes, após um VACUUM)
+    db.execute(f"PRAGMA auto_vacuum = {_config('DATABASE_AUTO_VACUUM')}")
+    if _config('DATABASE_WAL'):
+        db.execute('PRAGMA journal_mode = WAL')
+    db.execute(f"PRAGMA synchronous = {_config('DATABASE_SYNCHRONOUS')}")
+    db.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+    db.execute(f"PRAGMA mmap_size = {int(_config('DATABASE_MMAP_SIZE'))}")
+    db.execute(f"PRAGMA cache_size = {int(_config('DATABASE_CACHE_SIZE'))}")
+    return db
+
+def _is_healthy(db):
+    try:
+        db.execute('SELECT 1').fetchone()
+        return True
+    except sqlite3.Error:
+        return False
+
+def _thread_connection():
+    """Conexão reaproveitada pela thread atual (recriada após fork, troca de banco ou falha)"""
+    key = (current_app.config['DATABASE'], os.getpid())
+    db = getattr(_local, 'db', None)
+
+    if db is not None and (_local.key != key or not _is_healthy(db)):
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+        db = None
+
+    if db is None:
+        db = _connect()
+        _local.db = db
+        _local.key = key
+
+    return db
+
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        if _config('DATABASE_REUSE_CONNECTIONS'):
+            g.db = _thread_connection()
+        else:
+            g.db = _connect()
 
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
 
-    if db is not None:
+    if db is None:
+        return
+
+    if _config('DATABASE_REUSE_CONNECTIONS') and db is getattr(_local, 'db', None):
+        # Conexão volta para a thread; nada pendente pode vazar para o próximo request
+        if db.in_transaction:
+            db.rollback()
+    else:
         db.close()
 
+@contextmanager
+def immediate_transaction(db):
+    """
+    Executa o bloco em uma transação que pega o lock de escrita já no início
+    (BEGIN IMMEDIATE), evitando que outro processo escreva entre a leitura e a escrita.
+    Se já houver uma transação aberta, o bloco participa dela e o commit fica com quem a abriu.
+    """
+    if db.in_transaction:
+        yield db
+        return
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    else:
+        db.commit()
+
 def init_db():
     db = get_db()
 
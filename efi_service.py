@@ -6,18 +6,85 @@ import os
 import hashlib
 import hmac
 import json
+import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 load_dotenv()
 
 
+class TokenStore:
+    """
+    Cache do token OAuth compartilhado entre os workers (arquivo SQLite).
+    O token novo é pedido fora de qualquer lock do SQLite; a gravação é um
+    compare-and-swap: só substitui o token que o worker viu antes de pedir.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS efi_token (
+                    key TEXT PRIMARY KEY,
+                    access_token TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, key):
+        """Retorna (token, expires_at) ou None"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT access_token, expires_at FROM efi_token WHERE key = ?', (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+    def swap(self, key, expected, token, expires_at):
+        """
+        Grava o token se o atual ainda for `expected` (None: nenhum gravado).
+        Retorna o (token, expires_at) que ficou — o de outro worker, se ele gravou antes.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO efi_token (key, access_token, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET access_token = excluded.access_token, expires_at = excluded.expires_at
+                WHERE efi_token.access_token IS ?
+            ''', (key, token, expires_at, expected))
+            conn.commit()
+            return conn.execute(
+                'SELECT access_token, expires_at FROM efi_token WHERE key = ?', (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+    def discard(self, key, token):
+        """Remove o token (só se ainda for o mesmo — outro worker pode ter renovado)"""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM efi_token WHERE key = ? AND access_token = ?', (key, token))
+            conn.commit()
+        finally:
+            conn.close()
+
+
 class EfiService:
     """Classe para gerenciar pagamentos PIX via Efí API REST"""
+
+    CHARGE_EXPIRATION = 900  # segundos de validade da cobrança
     
-    def __init__(self):
-        """Inicializa a conexão com a API da Efí"""
+    def __init__(self, token_cache_path='efi_token_cache.db'):
+        """Inicializa a conexão com a API da Efí (`token_cache_path`: cache do token entre workers)"""
 
         env = os.getenv('EFI_ENVIRONMENT', 'sandbox').lower()
         self.is_sandbox = env == 'sandbox'
@@ -35,6 +102,9 @@ class EfiService:
             self.pix_key = os.getenv('EFI_PRODUCTION_PIX_KEY')
             self.base_url = 'https://pix.api.efipay.com.br'
 
+        # Outro endereço da API (ex.: fake_efi_server.py em http://127.0.0.1:9000)
+        self.base_url = os.getenv('EFI_BASE_URL', self.base_url).rstrip('/')
+
         # Corrigir .p12 → .pem baseado no ambiente
         if self.certificate_path.endswith('.p12'):
             # Tentar trocar extensão diretamente
@@ -50,49 +120,172 @@ class EfiService:
                     if os.path.exists('certs/producao.pem'):
                         self.certificate_path = 'certs/producao.pem'
 
+        # HTTP sem TLS (servidor local de testes) não usa certificado de cliente
+        if self.base_url.startswith('http://'):
+            self.certificate_path = None
+
         if not all([self.client_id, self.client_secret, self.pix_key]):
             raise ValueError("Credenciais da Efí incompletas. Verifique o .env")
 
+        # Token: reutilizado até perto de expirar e renovado antes, em segundo plano
         self.access_token = None
-        self.token_expiry = None
+        self.token_expiry = 0  # epoch (segundos)
+        self.token_margin = int(os.getenv('EFI_TOKEN_MARGIN', 60))
+        self.token_refresh_ahead = int(os.getenv('EFI_TOKEN_REFRESH_AHEAD', 300))
+        self.token_key = f"{self.base_url}|{self.client_id}"
+        self.token_store = TokenStore(os.getenv('EFI_TOKEN_CACHE_PATH') or token_cache_path)
+        self._token_lock = threading.Lock()
+        self._refreshing = threading.Lock()  # renovação em segundo plano em andamento
+
+        # Conexões HTTP: sessão com pool keep-alive (o handshake mTLS é feito uma vez por conexão)
+        self.pool_size = int(os.getenv('EFI_POOL_SIZE', 10))
+        self.timeout = (
+            float(os.getenv('EFI_CONNECT_TIMEOUT', 3.05)),
+            float(os.getenv('EFI_READ_TIMEOUT', 15)),
+        )
+        self.max_retries = int(os.getenv('EFI_MAX_RETRIES', 3))
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    # ==========================================================
+    # HTTP
+    # ==========================================================
+    def _get_session(self):
+        """Sessão do processo atual (recriada após fork: sockets não são compartilhados)"""
+        if self._session is not None and self._session_pid == os.getpid():
+            return self._session
+
+        with self._session_lock:
+            if self._session is None or self._session_pid != os.getpid():
+                # Retry com backoff: só GET é repetido após erro de leitura/status;
+                # falhas de conexão (nada foi enviado) são repetidas para qualquer método
+                retry = Retry(
+                    total=self.max_retries,
+                    backoff_factor=0.3,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.cert = self.certificate_path
+                session.verify = True
+
+                self._session = session
+                self._session_pid = os.getpid()
+
+        return self._session
+
+    def _request(self, method, path, **kwargs):
+        """Chamada autenticada à API; com 401 renova o token e tenta uma vez mais"""
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(2):
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers['Authorization'] = f"Bearer {self._get_access_token()}"
+            response = self._get_session().request(method, f"{self.base_url}{path}", headers=headers, **kwargs)
+
+            if response.status_code == 401 and attempt == 0:
+                self.invalidate_token()
+                kwargs['headers'] = headers
+                continue
+
+            response.raise_for_status()
+            return response
 
     # ==========================================================
     # TOKEN
     # ==========================================================
     def _get_access_token(self):
-        """Obtém token OAuth2 da Efí"""
+        """Obtém token OAuth2 da Efí (memória → cache compartilhado → nova requisição)"""
 
-        # TEMPORÁRIO: Invalidar token para forçar renovação
-        self.access_token = None
-        self.token_expiry = None
+        # Reutilizar o token em memória se válido
+        if self._token_valid(self.access_token, self.token_expiry):
+            self._maybe_refresh_ahead()
+            return self.access_token
 
-        # Reutilizar se válido
-        if self.access_token and self.token_expiry and datetime.now() < self.token_expiry:
+        # Outro worker pode já ter renovado
+        cached = self.token_store.load(self.token_key)
+        if cached and self._token_valid(*cached):
+            self.access_token, self.token_expiry = cached
+            self._maybe_refresh_ahead()
             return self.access_token
 
+        return self._refresh_access_token()
+
+    def _token_valid(self, token, expiry):
+        return bool(token) and time.time() < expiry - self.token_margin
+
+    def _maybe_refresh_ahead(self):
+        """Perto de expirar: renova em segundo plano, sem atrasar a chamada atual"""
+        if time.time() < self.token_expiry - self.token_refresh_ahead:
+            return
+        if not self._refreshing.acquire(blocking=False):
+            return  # outra thread já está renovando
+
+        def refresh():
+            try:
+                self._refresh_access_token(ahead=True)
+            except Exception as e:
+                print(f"Erro ao renovar token em segundo plano: {e}")
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=refresh, name='efi-token-refresh', daemon=True).start()
+
+    def invalidate_token(self):
+        """Descarta o token (ex.: a API respondeu 401)"""
+        if self.access_token:
+            self.token_store.discard(self.token_key, self.access_token)
+        self.access_token = None
+        self.token_expiry = 0
+
+    def _refresh_access_token(self, ahead=False):
+        """
+        Renova o token: uma thread por processo; entre processos, a requisição OAuth
+        fica fora do SQLite e a gravação só vale se ninguém renovou no meio (swap)
+        """
+        with self._token_lock:
+            # Conferir de novo: outra thread ou worker pode ter renovado
+            cached = self.token_store.load(self.token_key)
+            if cached and self._token_valid(*cached):
+                if not ahead or time.time() < cached[1] - self.token_refresh_ahead:
+                    self.access_token, self.token_expiry = cached
+                    return self.access_token
+
+            token, expiry = self._request_access_token()
+            stored = self.token_store.swap(self.token_key, cached[0] if cached else None, token, expiry)
+            # Perdeu a corrida: usar o token que o outro worker gravou (se ainda válido)
+            if stored and stored[0] != token and self._token_valid(*stored):
+                token, expiry = stored
+            self.access_token, self.token_expiry = token, expiry
+            return token
+
+    def _request_access_token(self):
+        """Requisição OAuth2 (client_credentials + mTLS); retorna (token, expires_at)"""
         print(f"DEBUG: Using cert path: {self.certificate_path}")
         
         scope_param = "gn.pix.write gn.pix.read"
         print(f"DEBUG: Requesting OAuth scopes: {scope_param}")
         
         try:
-            response = requests.post(
+            response = self._get_session().post(
                 f"{self.base_url}/oauth/token",
                 data={
                     "grant_type": "client_credentials",
                     "scope": scope_param
                 },
                 auth=(self.client_id, self.client_secret),
-                cert=self.certificate_path,
-                verify=True
+                timeout=self.timeout
             )
             response.raise_for_status()
 
             token_data = response.json()
-            self.access_token = token_data["access_token"]
-            self.token_expiry = datetime.now() + timedelta(seconds=token_data.get("expires_in", 3600) - 300)
-
-            return self.access_token
+            return token_data["access_token"], time.time() + token_data.get("expires_in", 3600)
 
         except Exception as e:
             raise Exception(f"Erro ao obter token: {str(e)}")
@@ -100,21 +293,22 @@ class EfiService:
     # ==========================================================
     # CRIAÇÃO DA COBRANÇA PIX
     # ==========================================================
-    def create_pix_charge(self, amount, raffle_title, raffle_id, user_id, tickets_data, cpf):
+    def create_pix_charge(self, amount, raffle_title, raffle_id, user_id, tickets_data, cpf, txid=None):
         """
-        Cria cobrança PIX imediata (geração de QR Code)
+        Cria cobrança PIX imediata
+        Retorna o payload copia-e-cola; o QR Code é gerado sob demanda por quem exibe
+        `txid` definido por quem chama (reserva da compra): o PUT /v2/cob/{txid} é idempotente
         """
 
         try:
-            token = self._get_access_token()
-            txid = self._generate_txid(raffle_id, user_id)
+            txid = txid or self._generate_txid(raffle_id, user_id)
 
             clean_cpf = ''.join(filter(str.isdigit, str(cpf)))
             if len(clean_cpf) != 11:
                 return {"success": False, "error": "CPF inválido (11 dígitos necessários)"}
 
             body = {
-                "calendario": {"expiracao": 900},
+                "calendario": {"expiracao": self.CHARGE_EXPIRATION},
                 "devedor": {
                     "nome": f"Usuário {user_id}",
                     "cpf": clean_cpf
@@ -130,51 +324,22 @@ class EfiService:
                 ]
             }
 
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-            }
-
             # Criar cobrança
-            response = requests.put(
-                f"{self.base_url}/v2/cob/{txid}",
-                headers=headers,
-                json=body,
-                cert=self.certificate_path,
-                verify=True
-            )
-            response.raise_for_status()
+            response = self._request("PUT", f"/v2/cob/{txid}", json=body)
             cob_data = response.json()
 
             # A resposta já inclui pixCopiaECola, não precisa de outra chamada!
             pix_code = cob_data.get('pixCopiaECola', '')
-            
-            # Gerar QR Code localmente (evita chamada extra e problema de escopo)
-            if pix_code:
-                import qrcode
-                import io
-                import base64
-                
-                qr = qrcode.QRCode(version=1, box_size=10, border=4)
-                qr.add_data(pix_code)
-                qr.make(fit=True)
-                
-                img = qr.make_image(fill_color="black", back_color="white")
-                buffer = io.BytesIO()
-                img.save(buffer, format='PNG')
-                qr_code_base64 = f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
-            else:
-                qr_code_base64 = ''
 
-            expiration = datetime.now() + timedelta(minutes=15)
+            expiration = datetime.now() + timedelta(seconds=self.CHARGE_EXPIRATION)
 
             return {
                 "success": True,
                 "txid": txid,
                 "loc_id": cob_data["loc"]["id"],
-                "qr_code": qr_code_base64,
                 "copy_paste": pix_code,
                 "expiration": expiration.isoformat(),
+                "expires_in": self.CHARGE_EXPIRATION,
                 "status": "pending"
             }
 
@@ -192,15 +357,7 @@ class EfiService:
     # ==========================================================
     def check_payment_status(self, txid):
         try:
-            token = self._get_access_token()
-
-            response = requests.get(
-                f"{self.base_url}/v2/cob/{txid}",
-                headers={"Authorization": f"Bearer {token}"},
-                cert=self.certificate_path,
-                verify=True
-            )
-            response.raise_for_status()
+            response = self._request("GET", f"/v2/cob/{txid}")
 
             cob = response.json()
 
@@ -222,6 +379,52 @@ class EfiService:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
+    # ==========================================================
+    # LISTAR COBRANÇAS (conciliação em lote)
+    # ==========================================================
+    def list_charges(self, inicio, fim, status=None, page=0, page_size=1000):
+        """
+        Lista as cobranças criadas no intervalo [inicio, fim] (datetime UTC), uma página por chamada.
+        Retorna {"success", "cobs", "page", "pages"}.
+        """
+        params = {
+            "inicio": inicio.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "fim": fim.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "paginacao.paginaAtual": page,
+            "paginacao.itensPorPagina": page_size,
+        }
+        if status:
+            params["status"] = status
+
+        try:
+            response = self._request("GET", "/v2/cob", params=params)
+            data = response.json()
+            paginacao = data.get("parametros", {}).get("paginacao", {})
+
+            return {
+                "success": True,
+                "cobs": data.get("cobs", []),
+                "page": paginacao.get("paginaAtual", page),
+                "pages": paginacao.get("quantidadeDePaginas", 1),
+            }
+
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def iter_charges(self, inicio, fim, status=None, page_size=1000):
+        """Percorre todas as páginas de list_charges; levanta exceção se uma página falhar"""
+        page = 0
+        while True:
+            result = self.list_charges(inicio, fim, status=status, page=page, page_size=page_size)
+            if not result["success"]:
+                raise Exception(result["error"])
+
+            yield from result["cobs"]
+
+            page += 1
+            if page >= result["pages"]:
+                break
+
     # ==========================================================
     # WEBHOOK
     # ==========================================================
@@ -250,5 +453,3 @@ class EfiService:
         base = f"{raffle_id}{user_id}{timestamp}"
         return hashlib.sha256(base.encode()).hexdigest()[:32].upper()
 
-
-efi_service = EfiService()
@@ -0,0 +1,49 @@
+"""
+Expiração de reservas: libera bilhetes pendentes cujo prazo (ticket.expires_at) passou
+Roda em lotes curtos, pelo job periódico ou pelo comando `flask expire-reservations`
+"""
+import click
+
+import background
+import database
+
+
+def release_expired_reservations(batch_size=500, max_batches=None):
+    """Apaga reservas vencidas em lotes (uma transação curta por lote); retorna quantas liberou"""
+    db = database.get_db()
+    released = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        with database.immediate_transaction(db):
+            cursor = db.execute('''
+                DELETE FROM ticket WHERE id IN (
+                    SELECT id FROM ticket
+                    WHERE payment_status = 'pending' AND expires_at < datetime('now')
+                    LIMIT ?
+                )
+            ''', (batch_size,))
+
+        released += cursor.rowcount
+        batches += 1
+        if cursor.rowcount < batch_size:
+            break
+
+    return released
+
+
+def init_app(app):
+    def sweep():
+        release_expired_reservations(
+            batch_size=app.config['EXPIRY_SWEEP_BATCH'],
+            max_batches=app.config['EXPIRY_SWEEP_MAX_BATCHES']
+        )
+
+    background.register_job(app, 'expire-reservations', app.config['EXPIRY_SWEEP_INTERVAL'], sweep)
+
+    @app.cli.command('expire-reservations')
+    @click.option('--batch-size', default=500, show_default=True)
+    def expire_reservations_command(batch_size):
+        """Libera agora todas as reservas vencidas."""
+        released = release_expired_reservations(batch_size=batch_size)
+        print(f'{released} reservas expiradas liberadas.')
@@ -0,0 +1,276 @@
+"""
+Servidor local que imita a API PIX da Efí (para desenvolvimento e testes de carga)
+
+Cobre OAuth, PUT/GET /v2/cob/{txid}, a lista GET /v2/cob e o webhook assinado
+(mesmo HMAC que EfiService.validate_webhook confere). Latência e falhas são
+configuráveis para simular a API real sob carga.
+
+Uso:
+    python fake_efi_server.py --port 9000 --webhook-url http://127.0.0.1:5000/webhook/efi
+
+E no .env do app:
+    EFI_BASE_URL=http://127.0.0.1:9000
+    EFI_SANDBOX_CLIENT_SECRET=<o mesmo de --webhook-secret>
+
+Pagamento manual de uma cobrança: POST /_fake/pay/{txid}
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+COB_PATH = re.compile(r'^/v2/cob/([A-Za-z0-9]{26,35})$')
+PAY_PATH = re.compile(r'^/_fake/pay/([A-Za-z0-9]{26,35})$')
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _parse_iso(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class FakeEfi:
+    """Estado em memória (tokens e cobranças) e regras de latência/falha/pagamento"""
+
+    def __init__(self, args):
+        self.args = args
+        self.tokens = {}
+        self.cobs = {}
+        self.lock = threading.Lock()
+        self.loc_seq = 0
+        self.webhook_session = requests.Session()
+
+    # Latência e falhas injetadas
+    def delay(self):
+        latency = self.args.latency_ms + random.uniform(-self.args.jitter_ms, self.args.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def should_fail(self):
+        return random.random() < self.args.fail_rate
+
+    # OAuth
+    def issue_token(self):
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self.tokens[token] = time.time() + self.args.token_ttl
+        return token
+
+    def token_valid(self, header):
+        if not header or not header.startswith('Bearer '):
+            return False
+        with self.lock:
+            expires_at = self.tokens.get(header[7:])
+        return expires_at is not None and time.time() < expires_at
+
+    # Cobranças
+    def create_cob(self, txid, body):
+        with self.lock:
+            self.loc_seq += 1
+            cob = {
+                'txid': txid,
+                'revisao': 0,
+                'status': 'ATIVA',
+                'calendario': {
+                    'criacao': _iso(_now()),
+                    'expiracao': body.get('calendario', {}).get('expiracao', 3600),
+                },
+                'devedor': body.get('devedor', {}),
+                'valor': body.get('valor', {}),
+                'chave': body.get('chave'),
+                'solicitacaoPagador': body.get('solicitacaoPagador'),
+                'loc': {'id': self.loc_seq, 'location': f'fake.efi/qr/v2/{txid}', 'tipoCob': 'cob'},
+                'pixCopiaECola': f'00020101021226830014BR.GOV.BCB.PIX2561fake.efi/qr/v2/{txid}5204000053039865802BR6304FAKE',
+            }
+            self.cobs[txid] = cob
+
+        if self.args.pay_after >= 0:
+            threading.Timer(self.args.pay_after, self.pay, args=(txid,)).start()
+        return cob
+
+    def pay(self, txid):
+        """Conclui a cobrança e envia o webhook assinado (como a Efí faz)"""
+        with self.lock:
+            cob = self.cobs.get(txid)
+            if not cob or cob['status'] != 'ATIVA':
+                return False
+            pix = {
+                'endToEndId': 'E' + secrets.token_hex(15).upper(),
+                'txid': txid,
+                'valor': cob['valor'].get('original', '0.00'),
+                'horario': _iso(_now()),
+            }
+            cob['status'] = 'CONCLUIDA'
+            cob['pix'] = [pix]
+
+        if self.args.webhook_url:
+            self.send_webhook({'pix': [pix]})
+        return True
+
+    def send_webhook(self, data):
+        payload = json.dumps(data).encode()
+        signature = hmac.new(self.args.webhook_secret.encode(), payload, hashlib.sha256).hexdigest()
+        for _attempt in range(3):
+            try:
+                response = self.webhook_session.post(
+                    self.args.webhook_url, data=payload, timeout=10,
+                    headers={'Content-Type': 'application/json', 'X-Efi-Signature': f'sha256={signature}'}
+                )
+                if response.status_code < 500:
+                    return
+            except requests.RequestException as e:
+                print(f'Webhook falhou: {e}')
+            time.sleep(1)
+
+    def list_cobs(self, query):
+        inicio = _parse_iso(query['inicio'][0])
+        fim = _parse_iso(query['fim'][0])
+        status = query.get('status', [None])[0]
+        page = int(query.get('paginacao.paginaAtual', ['0'])[0])
+        per_page = int(query.get('paginacao.itensPorPagina', ['100'])[0])
+
+        with self.lock:
+            cobs = [
+                cob for cob in self.cobs.values()
+                if inicio <= _parse_iso(cob['calendario']['criacao']) <= fim
+                and (status is None or cob['status'] == status)
+            ]
+
+        pages = max(1, -(-len(cobs) // per_page))
+        return {
+            'parametros': {
+                'inicio': query['inicio'][0],
+                'fim': query['fim'][0],
+                'paginacao': {
+                    'paginaAtual': page,
+                    'itensPorPagina': per_page,
+                    'quantidadeDePaginas': pages,
+                    'quantidadeTotalDeItens': len(cobs),
+                },
+            },
+            'cobs': cobs[page * per_page:(page + 1) * per_page],
+        }
+
+
+def make_handler(efi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            if efi.args.verbose:
+                super().log_message(format, *args)
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def handle_api(self, method):
+            body = self.read_body()
+            url = urlparse(self.path)
+
+            if method == 'POST' and PAY_PATH.match(url.path):
+                paid = efi.pay(PAY_PATH.match(url.path).group(1))
+                return self.send_json(200 if paid else 404, {'paid': paid})
+
+            efi.delay()
+            if efi.should_fail():
+                return self.send_json(efi.args.fail_status, {'nome': 'erro_simulado', 'mensagem': 'Falha injetada'})
+
+            if method == 'POST' and url.path == '/oauth/token':
+                if not self.headers.get('Authorization', '').startswith('Basic '):
+                    return self.send_json(401, {'error': 'invalid_client'})
+                return self.send_json(200, {
+                    'access_token': efi.issue_token(),
+                    'token_type': 'Bearer',
+                    'expires_in': efi.args.token_ttl,
+                    'scope': 'gn.pix.write gn.pix.read',
+                })
+
+            if not efi.token_valid(self.headers.get('Authorization')):
+                return self.send_json(401, {'nome': 'nao_autorizado', 'mensagem': 'Token inválido ou expirado'})
+
+            match = COB_PATH.match(url.path)
+            if method == 'PUT' and match:
+                try:
+                    data = json.loads(body or b'{}')
+                except ValueError:
+                    return self.send_json(400, {'nome': 'json_invalido'})
+                return self.send_json(201, efi.create_cob(match.group(1), data))
+
+            if method == 'GET' and match:
+                cob = efi.cobs.get(match.group(1))
+                if not cob:
+                    return self.send_json(404, {'nome': 'cobranca_nao_encontrada'})
+                return self.send_json(200, cob)
+
+            if method == 'GET' and url.path == '/v2/cob':
+                query = parse_qs(url.query)
+                if 'inicio' not in query or 'fim' not in query:
+                    return self.send_json(400, {'nome': 'parametros_invalidos'})
+                return self.send_json(200, efi.list_cobs(query))
+
+            return self.send_json(404, {'nome': 'nao_encontrado'})
+
+        def do_GET(self):
+            self.handle_api('GET')
+
+        def do_POST(self):
+            self.handle_api('POST')
+
+        def do_PUT(self):
+            self.handle_api('PUT')
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local que imita a API PIX da Efí')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=50, help='latência média de cada chamada')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='variação (+/-) da latência')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fração de chamadas que falham (0 a 1)')
+    parser.add_argument('--fail-status', type=int, default=503, help='status HTTP das falhas injetadas')
+    parser.add_argument('--token-ttl', type=int, default=3600, help='validade do token OAuth (segundos)')
+    parser.add_argument('--pay-after', type=float, default=-1,
+                        help='conclui cada cobrança após N segundos (negativo: só via /_fake/pay)')
+    parser.add_argument('--webhook-url', default='', help='URL do webhook do app (ex.: http://127.0.0.1:5000/webhook/efi)')
+    parser.add_argument('--webhook-secret', default='fake_client_secret',
+                        help='segredo do HMAC (o EFI_*_CLIENT_SECRET do app)')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(FakeEfi(args)))
+    print(f'Fake Efí em http://{args.host}:{args.port} (latência {args.latency_ms}ms, falhas {args.fail_rate:.0%})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+-- Migração: contadores desnormalizados de números vendidos/reservados na tabela 'raffle'
+-- As colunas sold_count/reserved_count são adicionadas por add_raffle_counters.py
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_insert
+AFTER INSERT ON ticket
+WHEN NEW.number IS NOT NULL
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count + (NEW.status IS 'paid'),
+        reserved_count = reserved_count + (NEW.status IS NOT 'paid')
+    WHERE id = NEW.raffle_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_delete
+AFTER DELETE ON ticket
+WHEN OLD.number IS NOT NULL
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count - (OLD.status IS 'paid'),
+        reserved_count = reserved_count - (OLD.status IS NOT 'paid')
+    WHERE id = OLD.raffle_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_update
+AFTER UPDATE OF number, status, raffle_id ON ticket
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count - (OLD.status IS 'paid'),
+        reserved_count = reserved_count - (OLD.status IS NOT 'paid')
+    WHERE id = OLD.raffle_id AND OLD.number IS NOT NULL;
+
+    UPDATE raffle
+    SET sold_count = sold_count + (NEW.status IS 'paid'),
+        reserved_count = reserved_count + (NEW.status IS NOT 'paid')
+    WHERE id = NEW.raffle_id AND NEW.number IS NOT NULL;
+END;
+
+-- Recalcular contadores a partir dos bilhetes existentes
+UPDATE raffle SET
+    sold_count = (SELECT COUNT(*) FROM ticket t WHERE t.raffle_id = raffle.id AND t.number IS NOT NULL AND t.status IS 'paid'),
+    reserved_count = (SELECT COUNT(*) FROM ticket t WHERE t.raffle_id = raffle.id AND t.number IS NOT NULL AND t.status IS NOT 'paid');
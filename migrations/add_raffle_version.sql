@@ -0,0 +1,53 @@
+-- Migração: versão por rifa usada para invalidar o cache de páginas
+-- A coluna raffle.version é adicionada por add_raffle_version.py
+-- Os triggers de contadores são recriados para também incrementar a versão
+
+DROP TRIGGER IF EXISTS trg_ticket_counts_insert;
+DROP TRIGGER IF EXISTS trg_ticket_counts_delete;
+DROP TRIGGER IF EXISTS trg_ticket_counts_update;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_insert
+AFTER INSERT ON ticket
+WHEN NEW.number IS NOT NULL
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count + (NEW.status IS 'paid'),
+        reserved_count = reserved_count + (NEW.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = NEW.raffle_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_delete
+AFTER DELETE ON ticket
+WHEN OLD.number IS NOT NULL
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count - (OLD.status IS 'paid'),
+        reserved_count = reserved_count - (OLD.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = OLD.raffle_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_update
+AFTER UPDATE OF number, status, raffle_id ON ticket
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count - (OLD.status IS 'paid'),
+        reserved_count = reserved_count - (OLD.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = OLD.raffle_id AND OLD.number IS NOT NULL;
+
+    UPDATE raffle
+    SET sold_count = sold_count + (NEW.status IS 'paid'),
+        reserved_count = reserved_count + (NEW.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = NEW.raffle_id AND NEW.number IS NOT NULL;
+END;
+
+-- Edição da rifa (dados, promoção, sorteio) incrementa a versão
+CREATE TRIGGER IF NOT EXISTS trg_raffle_version
+AFTER UPDATE OF title, description, price, total_numbers, image_url, status, type,
+                winner_ticket_id, promo_price, promo_end ON raffle
+BEGIN
+    UPDATE raffle SET version = version + 1 WHERE id = NEW.id;
+END;
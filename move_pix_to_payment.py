@@ -0,0 +1,67 @@
+import sqlite3
+
+def move_pix_to_payment():
+    """
+    Guarda o payload PIX uma vez por pagamento (payment.pix_copy_paste / expires_at)
+    e remove do ticket as colunas pix_qrcode, pix_copy_paste e payment_expiration
+    """
+    conn = sqlite3.connect('rifamaster.db')
+    cursor = conn.cursor()
+    
+    cursor.execute("PRAGMA table_info(payment)")
+    payment_columns = {row[1] for row in cursor.fetchall()}
+    
+    if 'pix_copy_paste' not in payment_columns:
+        cursor.execute('ALTER TABLE payment ADD COLUMN pix_copy_paste TEXT')
+        print("✓ Adicionada coluna 'payment.pix_copy_paste'")
+    else:
+        print("✓ Coluna 'payment.pix_copy_paste' já existe")
+    
+    if 'expires_at' not in payment_columns:
+        cursor.execute('ALTER TABLE payment ADD COLUMN expires_at TIMESTAMP')
+        print("✓ Adicionada coluna 'payment.expires_at'")
+    else:
+        print("✓ Coluna 'payment.expires_at' já existe")
+    
+    cursor.execute("PRAGMA table_info(ticket)")
+    ticket_columns = {row[1] for row in cursor.fetchall()}
+    
+    # Copiar o payload que estava repetido em cada bilhete
+    if 'pix_copy_paste' in ticket_columns:
+        cursor.execute('''
+            UPDATE payment
+            SET pix_copy_paste = (
+                SELECT MAX(t.pix_copy_paste) FROM ticket t WHERE t.payment_txid = payment.txid
+            )
+            WHERE pix_copy_paste IS NULL
+        ''')
+        print(f"✓ {cursor.rowcount} pagamentos com payload PIX copiado")
+    
+    # Cobranças antigas: 15 minutos a partir da criação
+    cursor.execute('''
+        UPDATE payment SET expires_at = datetime(created_at, '+900 seconds')
+        WHERE expires_at IS NULL
+    ''')
+    print(f"✓ {cursor.rowcount} pagamentos com validade preenchida")
+    
+    old_columns = [c for c in ('pix_qrcode', 'pix_copy_paste', 'payment_expiration') if c in ticket_columns]
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        for column in old_columns:
+            cursor.execute(f'ALTER TABLE ticket DROP COLUMN {column}')
+            print(f"✓ Removida coluna 'ticket.{column}'")
+    elif old_columns:
+        # SQLite antigo não tem DROP COLUMN: só limpar os dados
+        cursor.execute(f"UPDATE ticket SET {', '.join(c + ' = NULL' for c in old_columns)}")
+        print(f"✓ Colunas {', '.join(old_columns)} do ticket limpas (SQLite {sqlite3.sqlite_version} sem DROP COLUMN)")
+    
+    conn.commit()
+    
+    # Devolver ao disco o espaço dos QR Codes em base64
+    conn.execute('VACUUM')
+    print("✓ VACUUM concluído")
+    
+    conn.close()
+    print("\n✅ Migração concluída!")
+
+if __name__ == '__main__':
+    move_pix_to_payment()
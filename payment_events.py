@@ -0,0 +1,28 @@
+"""
+Aviso de mudança de status de pagamento para as conexões abertas (SSE)
+Dentro do mesmo worker o aviso é imediato (Condition); confirmações feitas por
+outro worker são percebidas pela releitura periódica do banco local.
+"""
+import threading
+
+_condition = threading.Condition()
+_generation = 0
+
+
+def notify():
+    """Avisa as conexões em espera que algum pagamento mudou de status"""
+    global _generation
+    with _condition:
+        _generation += 1
+        _condition.notify_all()
+
+
+def current():
+    return _generation
+
+
+def wait(generation, timeout):
+    """Espera um aviso posterior a `generation` (ou o timeout); retorna a geração atual"""
+    with _condition:
+        _condition.wait_for(lambda: _generation != generation, timeout)
+        return _generation
@@ -0,0 +1,49 @@
+"""
+Provedor de pagamentos PIX: registro de implementações e construção sob demanda
+O provedor só é criado no primeiro uso (cobrança, consulta, webhook), então
+iniciar workers, comandos de CLI (init-db) e testes não lê credenciais nem certificados.
+"""
+import os
+import threading
+
+from flask import current_app
+
+_factories = {}
+_instances = {}
+_lock = threading.Lock()
+
+
+def register_provider(name, factory):
+    """Registra uma fábrica (chamável sem argumentos) para o provedor `name`"""
+    _factories[name] = factory
+    _instances.pop(name, None)
+
+
+def get_payment_provider():
+    """Provedor configurado em PAYMENT_PROVIDER, criado na primeira chamada do processo"""
+    name = current_app.config['PAYMENT_PROVIDER']
+    provider = _instances.get(name)
+    if provider is not None:
+        return provider
+
+    with _lock:
+        provider = _instances.get(name)
+        if provider is None:
+            factory = _factories.get(name)
+            if factory is None:
+                raise ValueError(f"Provedor de pagamento desconhecido: {name}")
+            provider = _instances[name] = factory()
+    return provider
+
+
+def _efi_factory():
+    # Import tardio: requests/urllib3 e a leitura do .env da Efí só quando usados
+    from efi_service import EfiService
+    # Cache do token na pasta instance/ (local de cada instalação, fora do git)
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    return EfiService(token_cache_path=os.path.join(current_app.instance_path, 'efi_token_cache.db'))
+
+
+def init_app(app):
+    app.config.setdefault('PAYMENT_PROVIDER', 'efi')
+    _factories.setdefault('efi', _efi_factory)
@@ -0,0 +1,339 @@
+"""
+Pagamentos: confirmação (marca/gera os bilhetes) e conciliação em lote com a Efí
+Webhook, polling e o conciliador usam o mesmo caminho de confirmação;
+várias confirmações podem dividir uma única transação de escrita.
+"""
+import hashlib
+import io
+import secrets
+import time
+from datetime import datetime, timezone
+
+import click
+
+import background
+import database
+import payment_events
+from availability import pick_free_numbers
+from cache import SingleFlight, TTLCache
+from payment_provider import get_payment_provider
+
+
+def process_successful_payment(txid, db=None):
+    """
+    Confirma o pagamento `txid`: atualiza o status e gera os bilhetes se necessário.
+    Participa da transação de quem chamou, se houver uma aberta; senão abre a sua.
+    Retorna True se o pagamento foi confirmado agora (False se desconhecido ou já pago).
+    """
+    db = db or database.get_db()
+
+    # Lock de escrita desde a leitura: webhook e polling simultâneos não processam duas vezes
+    with database.immediate_transaction(db):
+        payment = db.execute('SELECT * FROM payment WHERE txid = ?', (txid,)).fetchone()
+
+        if not payment or payment['status'] == 'paid':
+            return False
+
+        # Atualizar pagamento
+        db.execute('UPDATE payment SET status = "paid", updated_at = CURRENT_TIMESTAMP WHERE id = ?', (payment['id'],))
+
+        if payment['type'] == 'manual':
+            # Atualizar tickets existentes
+            db.execute('''
+                UPDATE ticket
+                SET payment_status = 'paid', status = 'paid', paid_at = CURRENT_TIMESTAMP
+                WHERE payment_txid = ?
+            ''', (txid,))
+
+        elif payment['type'] == 'fazendinha':
+            # Gerar tickets agora
+            raffle_id = payment['raffle_id']
+            quantity = payment['ticket_count']
+            user_id = payment['user_id']
+
+            raffle = db.execute('SELECT total_numbers, sold_count, reserved_count FROM raffle WHERE id = ?', (raffle_id,)).fetchone()
+
+            # Sorteio O(k): não carrega os números já usados nem percorre 1..total
+            selected_numbers = pick_free_numbers(
+                db, raffle_id, raffle['total_numbers'],
+                raffle['sold_count'] + raffle['reserved_count'], quantity
+            )
+
+            if selected_numbers:
+                effective_price = payment['amount'] / quantity
+
+                db.executemany('''
+                    INSERT INTO ticket (user_id, raffle_id, number, status, payment_status, total_price, payment_txid, paid_at)
+                    VALUES (?, ?, ?, 'paid', 'paid', ?, ?, CURRENT_TIMESTAMP)
+                ''', [(user_id, raffle_id, number, effective_price, txid) for number in selected_numbers])
+
+    # Se a transação for de quem chamou, o aviso sai de novo após o commit dela
+    payment_events.notify()
+    return True
+
+
+def process_successful_payments(txids, db=None):
+    """Confirma vários pagamentos em uma única transação; retorna os txids confirmados agora"""
+    db = db or database.get_db()
+    processed = []
+
+    with database.immediate_transaction(db):
+        for txid in txids:
+            if process_successful_payment(txid, db):
+                processed.append(txid)
+
+    if processed:
+        payment_events.notify()
+    return processed
+
+
+# ==========================================================
+# IDEMPOTÊNCIA DA COBRANÇA (duplo clique / nova tentativa reaproveitam a cobrança viva)
+# ==========================================================
+def checkout_idempotency_key(checkout_key):
+    """Chave da compra fazendinha (gerada no checkout e guardada na sessão)"""
+    return f'checkout:{checkout_key}'
+
+
+def tickets_idempotency_key(ticket_ids):
+    """Chave da compra manual: o conjunto de bilhetes, independente da ordem"""
+    ids = ','.join(str(ticket_id) for ticket_id in sorted(set(ticket_ids)))
+    return 'tickets:' + hashlib.sha256(ids.encode()).hexdigest()[:32]
+
+
+def find_live_charge(db, user_id, idempotency_key=None, txid=None):
+    """
+    Cobrança pendente e ainda dentro da validade para a chave (ou txid) do usuário.
+    Retorna o mesmo formato de EfiService.create_pix_charge, ou None.
+    """
+    column, value = ('idempotency_key', idempotency_key) if idempotency_key else ('txid', txid)
+    if not value:
+        return None
+
+    rows = db.execute(f'''
+        SELECT txid, pix_copy_paste, expires_at,
+               CAST((julianday(expires_at) - julianday('now')) * 86400 AS INTEGER) AS expires_in
+        FROM payment
+        WHERE user_id = ? AND {column} = ? AND status = 'pending'
+          AND pix_copy_paste IS NOT NULL AND expires_at > datetime('now')
+    ''', (user_id, value)).fetchall()
+    if not rows:
+        return None
+
+    row = rows[0]
+    return {
+        'success': True,
+        'txid': row['txid'],
+        'copy_paste': row['pix_copy_paste'],
+        'expiration': row['expires_at'].isoformat() if hasattr(row['expires_at'], 'isoformat') else row['expires_at'],
+        'expires_in': row['expires_in'],
+        'status': 'pending',
+        'reused': True,
+    }
+
+
+# Reserva sem cobrança há mais que isso: a requisição que a criou morreu no meio
+CLAIM_TIMEOUT = 60  # segundos
+
+
+def release_expired_charge(db, user_id, idempotency_key):
+    """Cobrança vencida (ou reserva abandonada) da mesma chave deixa de bloquear uma nova (índice único parcial)"""
+    db.execute('''
+        UPDATE payment SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = ? AND idempotency_key = ? AND status = 'pending' AND expires_at <= datetime('now')
+    ''', (user_id, idempotency_key))
+    db.execute('''
+        DELETE FROM payment
+        WHERE user_id = ? AND idempotency_key = ? AND status = 'pending' AND pix_copy_paste IS NULL
+          AND created_at <= datetime('now', ?)
+    ''', (user_id, idempotency_key, f'-{CLAIM_TIMEOUT} seconds'))
+
+
+def new_txid():
+    """txid da cobrança (26 a 35 caracteres alfanuméricos), definido antes de chamar o provedor"""
+    return secrets.token_hex(16).upper()
+
+
+def claim_charge(db, user_id, raffle_id, amount, ticket_count, payment_type, idempotency_key=None):
+    """
+    Reserva a compra antes de chamar o provedor: grava o pagamento, ainda sem payload PIX,
+    com o txid que a cobrança vai usar. Sob o lock de escrita, só uma requisição da mesma
+    chave fica com a reserva; as outras esperam a cobrança dela (wait_for_charge).
+    Retorna {'state': 'live', 'charge': ...}, {'state': 'claimed', 'txid': ...} ou {'state': 'busy'}.
+    """
+    with database.immediate_transaction(db):
+        if idempotency_key:
+            release_expired_charge(db, user_id, idempotency_key)
+
+            live_charge = find_live_charge(db, user_id, idempotency_key)
+            if live_charge:
+                return {'state': 'live', 'charge': live_charge}
+
+            in_progress = db.execute('''
+                SELECT 1 FROM payment
+                WHERE user_id = ? AND idempotency_key = ? AND status = 'pending' AND pix_copy_paste IS NULL
+            ''', (user_id, idempotency_key)).fetchone()
+            if in_progress:
+                return {'state': 'busy'}
+
+        txid = new_txid()
+        db.execute('''
+            INSERT INTO payment (txid, user_id, raffle_id, amount, ticket_count, type, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (txid, user_id, raffle_id, amount, ticket_count, payment_type, idempotency_key))
+
+    return {'state': 'claimed', 'txid': txid}
+
+
+def complete_charge(db, claimed_txid, charge, ticket_ids=()):
+    """Guarda o payload da cobrança criada na reserva e vincula os bilhetes (compra manual)"""
+    with database.immediate_transaction(db):
+        # Provedor que não aceita txid externo devolve o seu: a reserva passa a usá-lo
+        db.execute('''
+            UPDATE payment
+            SET txid = ?, pix_copy_paste = ?, expires_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+            WHERE txid = ?
+        ''', (charge['txid'], charge['copy_paste'], f"+{charge['expires_in']} seconds", claimed_txid))
+        db.executemany('''
+            UPDATE ticket SET payment_txid = ?, payment_status = 'pending' WHERE id = ?
+        ''', [(charge['txid'], ticket_id) for ticket_id in ticket_ids])
+
+
+def abandon_charge(db, txid):
+    """O provedor recusou a cobrança: a reserva sai e a compra pode ser tentada de novo"""
+    with database.immediate_transaction(db):
+        db.execute("DELETE FROM payment WHERE txid = ? AND pix_copy_paste IS NULL", (txid,))
+
+
+def wait_for_charge(db, user_id, idempotency_key, timeout=15, interval=0.2):
+    """Espera a cobrança que outra requisição da mesma compra está criando; None se ela desistir"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        live_charge = find_live_charge(db, user_id, idempotency_key)
+        if live_charge:
+            return live_charge
+
+        in_progress = db.execute('''
+            SELECT 1 FROM payment
+            WHERE user_id = ? AND idempotency_key = ? AND status = 'pending' AND pix_copy_paste IS NULL
+        ''', (user_id, idempotency_key)).fetchone()
+        if not in_progress:
+            return None
+        time.sleep(interval)
+    return None
+
+
+# ==========================================================
+# CONSULTA DE STATUS (banco local primeiro, Efí só para pendentes)
+# ==========================================================
+_status_cache = TTLCache(max_entries=2048, ttl=3)
+_status_calls = SingleFlight()
+
+
+def lookup_payment_status(txid, cache_ttl=3):
+    """
+    Status do pagamento para o polling do cliente.
+    Status final no banco local (pago, expirado, cancelado): responde sem consultar a Efí.
+    Pendente: usa o resultado recente (`cache_ttl` segundos) e junta consultas simultâneas
+    do mesmo txid em uma só.
+    """
+    db = database.get_db()
+    rows = db.execute('SELECT status, updated_at FROM payment WHERE txid = ?', (txid,)).fetchall()
+    if rows and rows[0]['status'] == 'paid':
+        return {'success': True, 'status': 'paid', 'paid_at': str(rows[0]['updated_at'])}
+    if rows and rows[0]['status'] != 'pending':
+        return {'success': True, 'status': rows[0]['status']}
+
+    cached = _status_cache.get(txid)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        result = get_payment_provider().check_payment_status(txid)
+        if result.get('success'):
+            _status_cache.set(txid, result, ttl=cache_ttl)
+        return result
+
+    result = _status_calls.do(txid, fetch)
+
+    if result.get('success') and result.get('status') == 'paid':
+        process_successful_payment(txid, db)
+
+    return result
+
+
+# ==========================================================
+# QR CODE (gerado sob demanda a partir do payload salvo no pagamento)
+# ==========================================================
+_qr_cache = TTLCache(max_entries=512, ttl=900)
+
+
+def pix_qr_svg(txid, payload):
+    """SVG do QR Code do PIX; o payload de um txid não muda, então o resultado fica em cache"""
+    svg = _qr_cache.get(txid)
+    if svg is None:
+        import qrcode
+        import qrcode.image.svg
+
+        image = qrcode.make(payload, image_factory=qrcode.image.svg.SvgPathImage, border=2)
+        buffer = io.BytesIO()
+        image.save(buffer)
+        svg = buffer.getvalue()
+        _qr_cache.set(txid, svg)
+    return svg
+
+
+# ==========================================================
+# CONCILIAÇÃO (lista de cobranças por período, em vez de uma consulta por txid)
+# ==========================================================
+def reconcile_pending_payments(window_minutes=120, page_size=1000):
+    """
+    Confere na Efí os pagamentos pendentes criados nos últimos `window_minutes`
+    e confirma os que já foram pagos. Retorna os txids confirmados.
+    """
+    db = database.get_db()
+
+    # Período da consulta: do pagamento pendente mais antigo até agora (folga para relógios)
+    rows = db.execute('''
+        SELECT txid, datetime(created_at, '-5 minutes') AS since FROM payment
+        WHERE status = 'pending' AND created_at >= datetime('now', ?)
+    ''', (f'-{int(window_minutes)} minutes',)).fetchall()
+    if not rows:
+        return []
+
+    pending = {row['txid'] for row in rows}
+    inicio = datetime.fromisoformat(min(row['since'] for row in rows))
+    fim = datetime.now(timezone.utc)
+
+    paid = [
+        cob['txid']
+        for cob in get_payment_provider().iter_charges(inicio, fim, status='CONCLUIDA', page_size=page_size)
+        if cob.get('txid') in pending
+    ]
+    if not paid:
+        return []
+
+    return process_successful_payments(paid, db)
+
+
+def init_app(app):
+    def reconcile():
+        # Cada worker tem sua thread do job; só o que detém o arrendamento consulta a Efí
+        if not background.claim_lease('reconcile-payments', app.config['RECONCILE_INTERVAL']):
+            return
+        reconcile_pending_payments(
+            window_minutes=app.config['RECONCILE_WINDOW_MINUTES'],
+            page_size=app.config['RECONCILE_PAGE_SIZE']
+        )
+
+    background.register_job(app, 'reconcile-payments', app.config['RECONCILE_INTERVAL'], reconcile)
+
+    @app.cli.command('reconcile-payments')
+    @click.option('--window', default=120, show_default=True, help='Minutos para trás a conferir.')
+    def reconcile_payments_command(window):
+        """Confere os pagamentos pendentes na Efí e confirma os pagos."""
+        confirmed = reconcile_pending_payments(
+            window_minutes=window,
+            page_size=app.config['RECONCILE_PAGE_SIZE']
+        )
+        print(f'{len(confirmed)} pagamentos confirmados.')
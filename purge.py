@@ -0,0 +1,254 @@
+"""
+Exclusão de rifas em segundo plano
+A rota só marca as rifas (status 'deleting') e cria um registro em purge_job; o job
+de fundo apaga os dados em lotes curtos (uma transação por lote), sem segurar o lock
+de escrita e travar as compras. O progresso fica no próprio purge_job.
+Um job que falha volta para a fila com espera crescente (PURGE_RETRY_BACKOFF, dobrando
+a cada tentativa) até PURGE_MAX_ATTEMPTS; depois fica 'failed' até alguém pedir de novo
+(botão no painel ou `flask purge-raffles --retry-failed`).
+"""
+import time
+
+import click
+
+import background
+import database
+
+JOB_NAME = 'purge-raffles'
+
+# Ordem da exclusão: dependentes primeiro, a rifa por último (a marca 'deleting' vale até o fim)
+STEPS = (
+    ('raffle_draw', 'draws_deleted'),
+    ('ticket', 'tickets_deleted'),
+    ('payment', 'payments_deleted'),
+    ('raffle', 'raffles_deleted'),
+)
+
+# Um job 'running' sem progresso há mais que isso é retomado por outro worker
+STALE_AFTER = '-5 minutes'
+
+
+def _scope(job, table):
+    """
+    Filtro das linhas de `table` que o job apaga: as da rifa ou de todas as marcadas.
+    "Apagar tudo" também leva bilhetes, pagamentos e sorteios que já estavam sem rifa.
+    """
+    key = 'id' if table == 'raffle' else 'raffle_id'
+    if job['raffle_id'] is not None:
+        return f"{key} IN (SELECT id FROM raffle WHERE status = 'deleting' AND id = ?)", (job['raffle_id'],)
+
+    where = f"{key} IN (SELECT id FROM raffle WHERE status = 'deleting')"
+    if table != 'raffle':
+        where += ' OR raffle_id NOT IN (SELECT id FROM raffle)'
+    return where, ()
+
+
+def enqueue_purge(db, raffle_id=None, created_by=None):
+    """
+    Marca a rifa (ou todas) para exclusão e cria o job; retorna o id do purge_job.
+    As rifas marcadas saem das páginas públicas e não aceitam compras na hora.
+    """
+    with database.immediate_transaction(db):
+        if raffle_id is None:
+            db.execute("UPDATE raffle SET status = 'deleting' WHERE status != 'deleting'")
+            raffle_filter, params = '', ()
+        else:
+            db.execute("UPDATE raffle SET status = 'deleting' WHERE id = ?", (raffle_id,))
+            raffle_filter, params = 'AND id = ?', (raffle_id,)
+
+        # Totais para o progresso (contadores da rifa, sem contar bilhete por bilhete)
+        totals = db.execute(f'''
+            SELECT COALESCE(SUM(sold_count + reserved_count), 0) AS tickets, COUNT(*) AS raffles
+            FROM raffle WHERE status = 'deleting' {raffle_filter}
+        ''', params).fetchone()
+        payment_scope, payment_params = _scope({'raffle_id': raffle_id}, 'payment')
+        payments = db.execute(f'SELECT COUNT(*) FROM payment WHERE {payment_scope}', payment_params).fetchone()[0]
+
+        cursor = db.execute('''
+            INSERT INTO purge_job (raffle_id, tickets_total, payments_total, raffles_total, created_by)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (raffle_id, totals['tickets'], payments, totals['raffles'], created_by))
+
+    wake_worker()
+    return cursor.lastrowid
+
+
+def wake_worker():
+    job = background.get_job(JOB_NAME)
+    if job:
+        job.wake()
+
+
+def _claim_job(db):
+    """Pega o próximo job pendente (fora da espera de nova tentativa) ou abandonado por um worker que caiu"""
+    with database.immediate_transaction(db):
+        job = db.execute(f'''
+            SELECT * FROM purge_job
+            WHERE (status = 'pending' AND (retry_at IS NULL OR retry_at <= datetime('now')))
+               OR (status = 'running' AND updated_at < datetime('now', '{STALE_AFTER}'))
+            ORDER BY id LIMIT 1
+        ''').fetchone()
+        if job:
+            db.execute('''
+                UPDATE purge_job
+                SET status = 'running', started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (job['id'],))
+    return job
+
+
+def _delete_batch(db, job, table, counter, batch_size):
+    scope, params = _scope(job, table)
+
+    with database.immediate_transaction(db):
+        cursor = db.execute(f'''
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {scope} LIMIT ?
+            )
+        ''', params + (batch_size,))
+        db.execute(f'''
+            UPDATE purge_job SET {counter} = {counter} + ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (cursor.rowcount, job['id']))
+    return cursor.rowcount
+
+
+def run_purge_job(db, job, batch_size=500, pause=0.05):
+    """Apaga os dados do job em lotes; o intervalo entre lotes deixa as compras passarem"""
+    for table, counter in STEPS:
+        while _delete_batch(db, job, table, counter, batch_size) == batch_size:
+            if pause:
+                time.sleep(pause)
+
+    db.execute('''
+        UPDATE purge_job SET status = 'done', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (job['id'],))
+    db.commit()
+
+
+def reclaim_space(db, mode='incremental', pages=1000):
+    """
+    Devolve ao disco as páginas liberadas pela exclusão.
+    'incremental': incremental_vacuum em lotes (precisa de auto_vacuum = INCREMENTAL);
+    'full': VACUUM (bloqueia o banco, só para janelas de manutenção); 'none': nada.
+    """
+    if mode == 'incremental':
+        while db.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            before = db.execute('PRAGMA freelist_count').fetchone()[0]
+            db.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            if db.execute('PRAGMA freelist_count').fetchone()[0] >= before:
+                break  # banco sem auto_vacuum incremental: nada a fazer
+    elif mode == 'full':
+        db.execute('VACUUM')
+
+
+def _record_failure(db, job, error, max_attempts, retry_backoff):
+    """Falha do job: volta para a fila com espera crescente ou, esgotadas as tentativas, fica 'failed'"""
+    attempts = job['attempts'] + 1
+    if attempts < max_attempts:
+        delay = retry_backoff * 2 ** (attempts - 1)
+        db.execute('''
+            UPDATE purge_job
+            SET status = 'pending', attempts = ?, error = ?, retry_at = datetime('now', ?),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (attempts, error, f'+{delay} seconds', job['id']))
+    else:
+        db.execute('''
+            UPDATE purge_job SET status = 'failed', attempts = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (attempts, error, job['id']))
+    db.commit()
+
+
+def retry_failed_jobs(db, job_id=None):
+    """Devolve jobs 'failed' (um ou todos) para a fila com as tentativas zeradas; retorna quantos"""
+    job_filter, params = ('AND id = ?', (job_id,)) if job_id is not None else ('', ())
+    cursor = db.execute(f'''
+        UPDATE purge_job
+        SET status = 'pending', attempts = 0, retry_at = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'failed' {job_filter}
+    ''', params)
+    db.commit()
+    if cursor.rowcount:
+        wake_worker()
+    return cursor.rowcount
+
+
+def process_purge_jobs(batch_size=500, pause=0.05, vacuum='incremental', max_attempts=5, retry_backoff=60):
+    """Executa os jobs de exclusão pendentes; retorna quantos terminaram"""
+    db = database.get_db()
+    finished = 0
+
+    while True:
+        job = _claim_job(db)
+        if not job:
+            break
+
+        try:
+            run_purge_job(db, job, batch_size=batch_size, pause=pause)
+            finished += 1
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            _record_failure(db, job, str(e), max_attempts, retry_backoff)
+            raise
+
+    if finished:
+        reclaim_space(db, vacuum)
+    return finished
+
+
+def job_progress(job):
+    """Resumo do purge_job para a rota de status"""
+    done = job['tickets_deleted'] + job['payments_deleted'] + job['raffles_deleted']
+    total = job['tickets_total'] + job['payments_total'] + job['raffles_total']
+    if job['status'] == 'done':
+        percent = 100
+    else:
+        percent = min(99, int(done * 100 / total)) if total else 0
+
+    return {
+        'id': job['id'],
+        'raffle_id': job['raffle_id'],
+        'status': job['status'],
+        'percent': percent,
+        'tickets_deleted': job['tickets_deleted'],
+        'tickets_total': job['tickets_total'],
+        'payments_deleted': job['payments_deleted'],
+        'payments_total': job['payments_total'],
+        'raffles_deleted': job['raffles_deleted'],
+        'raffles_total': job['raffles_total'],
+        'error': job['error'],
+        'attempts': job['attempts'],
+        'retry_at': str(job['retry_at']) if job['retry_at'] else None,
+        'created_at': str(job['created_at']),
+        'finished_at': str(job['finished_at']) if job['finished_at'] else None,
+    }
+
+
+def init_app(app):
+    def purge():
+        process_purge_jobs(
+            batch_size=app.config['PURGE_BATCH'],
+            pause=app.config['PURGE_BATCH_PAUSE'],
+            vacuum=app.config['PURGE_VACUUM'],
+            max_attempts=app.config['PURGE_MAX_ATTEMPTS'],
+            retry_backoff=app.config['PURGE_RETRY_BACKOFF']
+        )
+
+    background.register_job(app, JOB_NAME, app.config['PURGE_INTERVAL'], purge)
+
+    @app.cli.command('purge-raffles')
+    @click.option('--vacuum', type=click.Choice(['none', 'incremental', 'full']), default='incremental', show_default=True)
+    @click.option('--retry-failed', is_flag=True, help='Devolve para a fila as exclusões que falharam.')
+    def purge_raffles_command(vacuum, retry_failed):
+        """Executa agora as exclusões de rifas pendentes."""
+        if retry_failed:
+            print(f'{retry_failed_jobs(database.get_db())} exclusões com falha de volta na fila.')
+        finished = process_purge_jobs(
+            batch_size=app.config['PURGE_BATCH'], pause=0, vacuum=vacuum,
+            max_attempts=app.config['PURGE_MAX_ATTEMPTS'], retry_backoff=app.config['PURGE_RETRY_BACKOFF']
+        )
+        print(f'{finished} exclusões concluídas.')
@@ -1,6 +1,11 @@
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS raffle;
 DROP TABLE IF EXISTS ticket;
+DROP TABLE IF EXISTS payment;
+DROP TABLE IF EXISTS webhook_inbox;
+DROP TABLE IF EXISTS raffle_draw;
+DROP TABLE IF EXISTS purge_job;
+DROP TABLE IF EXISTS job_lease;
 
 CREATE TABLE user (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,6 +32,9 @@ CREATE TABLE raffle (
     winner_ticket_id INTEGER,
     promo_price REAL,
     promo_end TIMESTAMP,
+    sold_count INTEGER NOT NULL DEFAULT 0,     -- mantido pelos triggers de ticket
+    reserved_count INTEGER NOT NULL DEFAULT 0, -- mantido pelos triggers de ticket
+    version INTEGER NOT NULL DEFAULT 0,        -- incrementado a cada mudança (cache de páginas)
     FOREIGN KEY (winner_ticket_id) REFERENCES ticket (id)
 );
 
@@ -37,18 +45,158 @@ CREATE TABLE ticket (
     number INTEGER, -- Nullable for pending random tickets
     status TEXT DEFAULT 'pending',
     purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    payment_txid TEXT UNIQUE,
+    payment_txid TEXT, -- compartilhado por todos os bilhetes do mesmo pagamento
     payment_status TEXT DEFAULT 'pending',
-    pix_qrcode TEXT,
-    pix_copy_paste TEXT,
-    payment_expiration TIMESTAMP,
     paid_at TIMESTAMP,
     total_price REAL,
+    created_at TIMESTAMP,
+    expires_at TIMESTAMP, -- fim da reserva de bilhetes pendentes (UTC)
     FOREIGN KEY (user_id) REFERENCES user (id),
     FOREIGN KEY (raffle_id) REFERENCES raffle (id)
 );
 
+CREATE TABLE payment (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    txid TEXT UNIQUE NOT NULL,
+    user_id INTEGER NOT NULL,
+    raffle_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT DEFAULT 'pending',
+    ticket_count INTEGER DEFAULT 0,
+    type TEXT NOT NULL,
+    pix_copy_paste TEXT, -- payload PIX (o QR Code é gerado sob demanda a partir dele)
+    expires_at TIMESTAMP, -- fim da validade da cobrança (UTC)
+    idempotency_key TEXT, -- mesma compra (checkout/conjunto de bilhetes) reaproveita a cobrança
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user (id),
+    FOREIGN KEY (raffle_id) REFERENCES raffle (id)
+);
+
+-- Notificações do webhook da Efí: gravadas ao receber, processadas pelo job de fundo
+CREATE TABLE webhook_inbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_key TEXT UNIQUE NOT NULL, -- endToEndId (ou txid): reenvios da Efí são ignorados
+    txid TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+-- Registro auditável de cada sorteio: o vencedor é o bilhete pago na posição
+-- sha256(seed:raffle_id:ticket_count) % ticket_count, ordenando por número
+CREATE TABLE raffle_draw (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    raffle_id INTEGER UNIQUE NOT NULL,
+    ticket_id INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    ticket_count INTEGER NOT NULL,
+    draw_offset INTEGER NOT NULL,
+    seed TEXT NOT NULL,
+    drawn_by INTEGER,
+    drawn_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (raffle_id) REFERENCES raffle (id),
+    FOREIGN KEY (ticket_id) REFERENCES ticket (id),
+    FOREIGN KEY (drawn_by) REFERENCES user (id)
+);
+
+-- Jobs que devem rodar em um só processo por intervalo (ex.: conciliação com a Efí)
+CREATE TABLE job_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL, -- host:pid do processo que pegou o job
+    expires_at TIMESTAMP NOT NULL -- outro processo só pega depois disso (UTC)
+);
+
+-- Exclusão de rifas em segundo plano (raffle_id NULL = todas as rifas marcadas 'deleting')
+CREATE TABLE purge_job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    raffle_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending, running, done, failed
+    tickets_total INTEGER NOT NULL DEFAULT 0,
+    payments_total INTEGER NOT NULL DEFAULT 0,
+    raffles_total INTEGER NOT NULL DEFAULT 0,
+    tickets_deleted INTEGER NOT NULL DEFAULT 0,
+    payments_deleted INTEGER NOT NULL DEFAULT 0,
+    raffles_deleted INTEGER NOT NULL DEFAULT 0,
+    draws_deleted INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0, -- falhas até agora
+    retry_at TIMESTAMP, -- nova tentativa não antes disso (UTC)
+    created_by INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (created_by) REFERENCES user (id)
+);
+
 -- Índices para performance
 CREATE INDEX IF NOT EXISTS idx_ticket_payment_txid ON ticket(payment_txid);
 CREATE INDEX IF NOT EXISTS idx_ticket_payment_status ON ticket(payment_status);
-CREATE INDEX IF NOT EXISTS idx_ticket_user_raffle ON ticket(user_id, raffle_id);
+-- Bilhetes do usuário por rifa, já na ordem do dashboard (paginação por chave)
+CREATE INDEX IF NOT EXISTS idx_ticket_user_raffle_number ON ticket(user_id, raffle_id, COALESCE(number, 0));
+-- Um número só pode existir uma vez por rifa (NULLs de fazendinha pendente são permitidos)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ticket_raffle_number_unique ON ticket(raffle_id, number);
+-- Sorteio: contagem e busca por posição apenas entre os bilhetes pagos
+CREATE INDEX IF NOT EXISTS idx_ticket_paid_number ON ticket(raffle_id, number) WHERE status = 'paid' AND number IS NOT NULL;
+-- Varredura de reservas vencidas (apenas bilhetes pendentes entram no índice)
+CREATE INDEX IF NOT EXISTS idx_ticket_pending_expires_at ON ticket(expires_at) WHERE payment_status = 'pending';
+-- Totais por rifa do painel admin (GROUP BY raffle_id resolvido só no índice)
+CREATE INDEX IF NOT EXISTS idx_payment_raffle_status ON payment(raffle_id, status, amount, expires_at);
+-- Conciliação: pagamentos pendentes recentes
+CREATE INDEX IF NOT EXISTS idx_payment_pending_created_at ON payment(created_at) WHERE status = 'pending';
+-- Uma cobrança pendente por compra (duplo clique não gera outra)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_pending_idempotency ON payment(user_id, idempotency_key) WHERE status = 'pending' AND idempotency_key IS NOT NULL;
+-- Fila do webhook (apenas notificações não processadas)
+CREATE INDEX IF NOT EXISTS idx_webhook_inbox_pending ON webhook_inbox(id) WHERE status = 'pending';
+
+-- Contadores de números vendidos/reservados por rifa (raffle.sold_count / reserved_count)
+-- Toda mudança de bilhete também incrementa raffle.version (invalida o cache de páginas)
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_insert
+AFTER INSERT ON ticket
+WHEN NEW.number IS NOT NULL
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count + (NEW.status IS 'paid'),
+        reserved_count = reserved_count + (NEW.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = NEW.raffle_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_delete
+AFTER DELETE ON ticket
+WHEN OLD.number IS NOT NULL
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count - (OLD.status IS 'paid'),
+        reserved_count = reserved_count - (OLD.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = OLD.raffle_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_ticket_counts_update
+AFTER UPDATE OF number, status, raffle_id ON ticket
+BEGIN
+    UPDATE raffle
+    SET sold_count = sold_count - (OLD.status IS 'paid'),
+        reserved_count = reserved_count - (OLD.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = OLD.raffle_id AND OLD.number IS NOT NULL;
+
+    UPDATE raffle
+    SET sold_count = sold_count + (NEW.status IS 'paid'),
+        reserved_count = reserved_count + (NEW.status IS NOT 'paid'),
+        version = version + 1
+    WHERE id = NEW.raffle_id AND NEW.number IS NOT NULL;
+END;
+
+-- Edição da rifa (dados, promoção, sorteio) incrementa a versão
+CREATE TRIGGER IF NOT EXISTS trg_raffle_version
+AFTER UPDATE OF title, description, price, total_numbers, image_url, status, type,
+                winner_ticket_id, promo_price, promo_end ON raffle
+BEGIN
+    UPDATE raffle SET version = version + 1 WHERE id = NEW.id;
+END;
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+import database  # noqa: E402
+import payment_provider  # noqa: E402
+
+
+class FakeProvider:
+    """Provedor PIX em memória: conta as cobranças criadas"""
+
+    def __init__(self):
+        self.charges = []
+        self.delay = 0
+
+    def create_pix_charge(self, amount, raffle_title, raffle_id, user_id, tickets_data, cpf, txid=None):
+        time.sleep(self.delay)
+        self.charges.append(txid)
+        return {
+            'success': True,
+            'txid': txid,
+            'loc_id': len(self.charges),
+            'copy_paste': f'PIX-{txid}',
+            'expiration': '',
+            'expires_in': 900,
+            'status': 'pending',
+        }
+
+    def check_payment_status(self, txid):
+        return {'success': True, 'status': 'pending'}
+
+    def iter_charges(self, *args, **kwargs):
+        return iter(())
+
+
+@pytest.fixture
+def provider():
+    fake = FakeProvider()
+    payment_provider.register_provider('fake', lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def app(tmp_path, provider):
+    flask_app = app_module.app
+    # app é global do módulo: o que um teste mudar na config volta ao valor original no fim
+    saved_config = dict(flask_app.config)
+    flask_app.config.update(
+        TESTING=True,
+        DATABASE=str(tmp_path / 'test.db'),
+        BACKGROUND_JOBS_ENABLED=False,
+        PAYMENT_PROVIDER='fake',
+    )
+    app_module.user_cache.clear()
+    with flask_app.app_context():
+        database.init_db()
+    yield flask_app
+    flask_app.config.clear()
+    flask_app.config.update(saved_config)
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        yield database.get_db()
+
+
+def login(client, email='a@a.com', cpf='52998224725'):
+    """Cadastra e entra; o primeiro usuário cadastrado é admin"""
+    client.post('/register', data={'username': email.split('@')[0], 'email': email, 'password': 'p', 'cpf': cpf})
+    client.post('/login', data={'email': email, 'password': 'p'})
+    return client
@@ -0,0 +1,41 @@
+import re
+
+from conftest import login
+
+
+def page_ids(html):
+    return [int(raffle_id) for raffle_id in re.findall(r'admin/draw/(\d+)', html)]
+
+
+def test_newer_link_goes_back_one_keyset_page(app, db, monkeypatch):
+    client = login(app.test_client())
+    for number in range(7):
+        db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES (?, 2, 10)", (f'R{number}',))
+    db.commit()
+    monkeypatch.setitem(app.config, 'ADMIN_PAGE_SIZE', 3)
+
+    first = client.get('/admin').get_data(as_text=True)
+    assert page_ids(first) == [7, 6, 5] and 'after=' not in first
+    second = client.get('/admin?before=5').get_data(as_text=True)
+    assert page_ids(second) == [4, 3, 2]
+    third = client.get('/admin?before=2').get_data(as_text=True)
+    assert page_ids(third) == [1] and 'before=' not in third
+
+    # "Mais recentes" volta para a página anterior, não para a primeira
+    assert 'after=1' in third
+    assert page_ids(client.get('/admin?after=1').get_data(as_text=True)) == [4, 3, 2]
+    newest = client.get('/admin?after=4').get_data(as_text=True)
+    assert page_ids(newest) == [7, 6, 5] and 'after=' not in newest and 'before=5' in newest
+
+
+def test_tickets_without_number_still_block_delete(app, db):
+    client = login(app.test_client())
+    raffle_id = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES ('R', 2, 10)").lastrowid
+    db.commit()
+    assert f'admin/delete_raffle/{raffle_id}' in client.get('/admin').get_data(as_text=True)
+
+    # Reserva aleatória antiga, sem número: fora dos contadores, mas conta para o delete
+    db.execute("INSERT INTO ticket (user_id, raffle_id, number) VALUES (1, ?, NULL)", (raffle_id,))
+    db.commit()
+
+    assert f'admin/delete_raffle/{raffle_id}' not in client.get('/admin').get_data(as_text=True)
@@ -0,0 +1,73 @@
+from conftest import login
+
+
+def add_tickets(db, raffle_id, numbers, txid, payment_status='paid'):
+    for number in numbers:
+        db.execute('''
+            INSERT INTO ticket (user_id, raffle_id, number, status, payment_status, payment_txid, expires_at)
+            VALUES (1, ?, ?, ?, ?, ?, datetime('now', '+10 minutes'))
+        ''', (raffle_id, number, 'paid' if payment_status == 'paid' else 'pending', payment_status, txid))
+    db.commit()
+
+
+def fetch_blocks(client, raffle_id, after='0:0'):
+    return client.get(f'/dashboard/raffle/{raffle_id}/blocks?after={after}').get_json()
+
+
+def test_blocks_page_reads_a_bounded_window(app, db, monkeypatch):
+    client = login(app.test_client())
+    raffle_id = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES ('R', 2, 100)").lastrowid
+    add_tickets(db, raffle_id, range(1, 4), 'A')
+    add_tickets(db, raffle_id, range(10, 13), 'B')
+    monkeypatch.setitem(app.config, 'DASHBOARD_TICKET_WINDOW', 4)
+
+    # A janela corta o segundo bloco: ele fica inteiro para a próxima página
+    first = fetch_blocks(client, raffle_id)
+    assert first['count'] == 1 and first['next_cursor']
+    second = fetch_blocks(client, raffle_id, first['next_cursor'])
+    assert second['count'] == 1 and second['next_cursor'] is None
+    assert '10 – 12' in second['html']
+
+
+def test_pending_block_offers_payment_and_countdown(app, db):
+    client = login(app.test_client())
+    raffle_id = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES ('R', 2, 100)").lastrowid
+    add_tickets(db, raffle_id, range(1, 6), 'P', payment_status='pending')
+
+    html = fetch_blocks(client, raffle_id)['html']
+
+    assert 'retryPayment(' in html
+    assert 'data-time-remaining' in html
+
+
+def test_dashboard_lists_each_raffle_with_its_first_blocks(app, db):
+    client = login(app.test_client())
+    first = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES ('Alfa', 2, 100)").lastrowid
+    second = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES ('Beta', 2, 100)").lastrowid
+    add_tickets(db, first, range(1, 4), 'A')
+    add_tickets(db, second, (5, 9), 'B')
+
+    html = client.get('/dashboard').get_data(as_text=True)
+
+    assert 'Alfa' in html and '3 bilhetes' in html and '1 – 3' in html
+    assert 'Beta' in html and '2 bilhetes' in html
+
+
+def test_dashboard_pages_raffles_by_title(app, db, monkeypatch):
+    client = login(app.test_client())
+    monkeypatch.setitem(app.config, 'DASHBOARD_RAFFLE_PAGE_SIZE', 2)
+    monkeypatch.setitem(app.config, 'DASHBOARD_TICKET_WINDOW', 4)
+    for title in ('Gama', 'Alfa', 'Beta'):
+        raffle_id = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES (?, 2, 100)", (title,)).lastrowid
+        add_tickets(db, raffle_id, range(1, 4), title)
+        add_tickets(db, raffle_id, range(10, 13), title + '2')
+
+    first = client.get('/dashboard').get_data(as_text=True)
+    assert 'Alfa' in first and 'Beta' in first and 'Gama' not in first
+    # Cada rifa da página mostra só a primeira janela de blocos
+    assert first.count('10 – 12') == 0 and first.count('Carregar mais bilhetes') == 2
+
+    beta = db.execute("SELECT id FROM raffle WHERE title = 'Beta'").fetchone()['id']
+    assert f'/dashboard?after={beta}' in first
+    second = client.get(f'/dashboard?after={beta}').get_data(as_text=True)
+    assert 'Gama' in second and 'Alfa' not in second and 'Mais rifas' not in second
@@ -0,0 +1,44 @@
+import draw
+
+
+def create_raffle(db, status='active', paid_numbers=()):
+    raffle_id = db.execute(
+        "INSERT INTO raffle (title, price, total_numbers, status) VALUES ('R', 2, 100, ?)", (status,)
+    ).lastrowid
+    for number in paid_numbers:
+        db.execute(
+            "INSERT INTO ticket (user_id, raffle_id, number, status, payment_status) VALUES (1, ?, ?, 'paid', 'paid')",
+            (raffle_id, number)
+        )
+    db.commit()
+    return raffle_id
+
+
+def test_draw_picks_a_paid_ticket_and_can_be_verified(db):
+    raffle_id = create_raffle(db, paid_numbers=(3, 7, 42))
+
+    result = draw.draw_winner(db, raffle_id, drawn_by=1)
+
+    assert result['success']
+    assert result['ticket']['number'] in (3, 7, 42)
+    raffle = db.execute('SELECT status, winner_ticket_id FROM raffle WHERE id = ?', (raffle_id,)).fetchone()
+    assert raffle['status'] == 'closed'
+    assert raffle['winner_ticket_id'] == result['ticket']['id']
+    assert draw.verify_draw(db, raffle_id)[1]
+
+
+def test_closed_raffle_without_winner_can_be_drawn(db):
+    raffle_id = create_raffle(db, status='closed', paid_numbers=(1,))
+
+    assert draw.draw_winner(db, raffle_id)['success']
+
+
+def test_draw_refusals_have_distinct_reasons(db):
+    drawn = create_raffle(db, paid_numbers=(1,))
+    draw.draw_winner(db, drawn)
+    deleting = create_raffle(db, status='deleting', paid_numbers=(1,))
+    empty = create_raffle(db)
+
+    errors = [draw.draw_winner(db, raffle_id)['error'] for raffle_id in (drawn, deleting, empty, 9999)]
+
+    assert len(set(errors)) == 4
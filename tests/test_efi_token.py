@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from efi_service import EfiService, TokenStore
+
+
+@pytest.fixture
+def efi(tmp_path, monkeypatch):
+    monkeypatch.setenv('EFI_ENVIRONMENT', 'sandbox')
+    monkeypatch.setenv('EFI_SANDBOX_CLIENT_ID', 'id')
+    monkeypatch.setenv('EFI_SANDBOX_CLIENT_SECRET', 'secret')
+    monkeypatch.setenv('EFI_SANDBOX_PIX_KEY', 'key')
+    monkeypatch.setenv('EFI_BASE_URL', 'http://127.0.0.1:9')
+    monkeypatch.delenv('EFI_TOKEN_CACHE_PATH', raising=False)
+    return lambda: EfiService(token_cache_path=str(tmp_path / 'token.db'))
+
+
+def test_swap_keeps_the_token_written_first(tmp_path):
+    store = TokenStore(str(tmp_path / 'token.db'))
+
+    assert store.swap('k', None, 'A', 100) == ('A', 100)
+    # Outro worker renovou depois de ver o mesmo estado: a gravação dele não vale
+    assert store.swap('k', None, 'B', 200) == ('A', 100)
+    assert store.swap('k', 'A', 'C', 300) == ('C', 300)
+
+
+def test_refresh_does_not_hold_the_store_while_requesting(efi):
+    first, second = efi(), efi()
+    requesting = threading.Event()
+    release = threading.Event()
+
+    def slow_request():
+        requesting.set()
+        release.wait(5)
+        return 'SLOW', time.time() + 3600
+
+    first._request_access_token = slow_request
+    second._request_access_token = lambda: ('FAST', time.time() + 3600)
+
+    thread = threading.Thread(target=first._get_access_token)
+    thread.start()
+    requesting.wait(5)
+
+    # O outro worker não espera pela requisição OAuth do primeiro
+    assert second._get_access_token() == 'FAST'
+
+    release.set()
+    thread.join()
+    assert first.access_token == 'FAST'  # perdeu o swap e adotou o token gravado
+
+
+def test_only_one_background_refresh_at_a_time(efi):
+    service = efi()
+    service.access_token, service.token_expiry = 'OLD', time.time() + 200  # dentro da antecedência
+    calls = []
+    release = threading.Event()
+
+    def request():
+        calls.append(1)
+        release.wait(5)
+        return 'NEW', time.time() + 3600
+
+    service._request_access_token = request
+    for _ in range(5):
+        assert service._get_access_token() == 'OLD'
+    release.set()
+
+    assert service._refreshing.acquire(timeout=5)  # renovação terminou
+    assert len(calls) == 1
+    assert service.access_token == 'NEW'
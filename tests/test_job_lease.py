@@ -0,0 +1,23 @@
+import background
+
+
+def test_only_the_lease_holder_reconciles(app, db, provider, monkeypatch):
+    calls = []
+    monkeypatch.setattr(provider, 'iter_charges', lambda *args, **kwargs: calls.append(args) or iter(()))
+    db.execute("INSERT INTO payment (txid, user_id, raffle_id, amount, type, status) VALUES ('TX1', 1, 1, 2, 'manual', 'pending')")
+    db.commit()
+    reconcile = background.get_job('reconcile-payments').func
+
+    # Outro worker detém o arrendamento: este não consulta a Efí
+    db.execute("INSERT INTO job_lease (name, holder, expires_at) VALUES ('reconcile-payments', 'outro:1', datetime('now', '+60 seconds'))")
+    db.commit()
+    reconcile()
+    assert calls == []
+
+    # Arrendamento vencido: o próximo worker assume e renova
+    db.execute("UPDATE job_lease SET expires_at = datetime('now', '-1 seconds')")
+    db.commit()
+    reconcile()
+    reconcile()
+    assert len(calls) == 2
+    assert background.claim_lease('reconcile-payments', 60)
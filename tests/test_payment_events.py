@@ -0,0 +1,36 @@
+import json
+
+import payments
+from conftest import login
+
+
+def read_events(response):
+    events = []
+    for chunk in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in chunk.splitlines() if line.startswith(('event', 'data')))
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])['status']))
+    return events
+
+
+def test_final_status_ends_the_stream(app, db):
+    client = login(app.test_client())
+    db.execute("INSERT INTO payment (txid, user_id, raffle_id, amount, type, status) VALUES ('TX1', 1, 1, 2, 'manual', 'expired')")
+    db.commit()
+
+    events = read_events(client.get('/payment_events/TX1'))
+
+    assert events == [('status', 'expired'), ('end', 'expired')]
+
+
+def test_final_local_status_is_answered_without_the_provider(app, db, provider, monkeypatch):
+    calls = []
+    monkeypatch.setattr(provider, 'check_payment_status', lambda txid: calls.append(txid) or {'success': True, 'status': 'pending'})
+    db.execute("INSERT INTO payment (txid, user_id, raffle_id, amount, type, status) VALUES ('TX1', 1, 1, 2, 'manual', 'expired')")
+    db.execute("INSERT INTO payment (txid, user_id, raffle_id, amount, type, status) VALUES ('TX2', 1, 1, 2, 'manual', 'pending')")
+    db.commit()
+
+    assert payments.lookup_payment_status('TX1') == {'success': True, 'status': 'expired'}
+    assert calls == []
+    assert payments.lookup_payment_status('TX2')['status'] == 'pending'
+    assert calls == ['TX2']
@@ -0,0 +1,105 @@
+import threading
+
+from conftest import login
+
+
+def create_raffle(db, raffle_type='manual', total_numbers=100):
+    cursor = db.execute(
+        "INSERT INTO raffle (title, price, total_numbers, status, type) VALUES ('R', 2, ?, 'active', ?)",
+        (total_numbers, raffle_type)
+    )
+    db.commit()
+    return cursor.lastrowid
+
+
+def test_concurrent_requests_for_same_tickets_create_one_charge(app, db, provider):
+    raffle_id = create_raffle(db)
+    client = login(app.test_client())
+    client.post(f'/raffle/{raffle_id}/buy', data={'numbers': ['5', '6']})
+    ticket_ids = ','.join(str(row['id']) for row in db.execute('SELECT id FROM ticket ORDER BY id'))
+
+    provider.delay = 0.3  # a primeira ainda está na Efí quando a segunda chega
+    results = []
+
+    def submit():
+        results.append(client.post('/create_pix_payment', data={'ticket_ids': ticket_ids}).get_json())
+
+    threads = [threading.Thread(target=submit) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(provider.charges) == 1
+    assert [result['txid'] for result in results] == provider.charges * 2
+    assert db.execute("SELECT COUNT(*) FROM payment").fetchone()[0] == 1
+
+
+def test_repeated_request_reuses_live_charge(app, db, provider):
+    raffle_id = create_raffle(db)
+    client = login(app.test_client())
+    client.post(f'/raffle/{raffle_id}/buy', data={'numbers': ['7']})
+    ticket_id = db.execute('SELECT id FROM ticket').fetchone()['id']
+
+    first = client.post('/create_pix_payment', data={'ticket_ids': str(ticket_id)}).get_json()
+    second = client.post('/create_pix_payment', data={'ticket_ids': str(ticket_id)}).get_json()
+
+    assert first['txid'] == second['txid']
+    assert second['reused'] is True
+    assert len(provider.charges) == 1
+
+
+def test_failed_charge_releases_the_claim(app, db, provider):
+    raffle_id = create_raffle(db)
+    client = login(app.test_client())
+    client.post(f'/raffle/{raffle_id}/buy', data={'numbers': ['8']})
+    ticket_id = db.execute('SELECT id FROM ticket').fetchone()['id']
+
+    provider.create_pix_charge = lambda **kwargs: {'success': False, 'error': 'Efí fora do ar'}
+    response = client.post('/create_pix_payment', data={'ticket_ids': str(ticket_id)})
+    assert response.status_code == 400
+    assert db.execute("SELECT COUNT(*) FROM payment").fetchone()[0] == 0
+
+
+def test_concurrent_retries_create_one_charge_and_keep_the_old_payment(app, db, provider):
+    raffle_id = create_raffle(db)
+    client = login(app.test_client())
+    client.post(f'/raffle/{raffle_id}/buy', data={'numbers': ['1', '2']})
+    ticket_ids = [row['id'] for row in db.execute('SELECT id FROM ticket ORDER BY id')]
+    old_txid = client.post('/create_pix_payment', data={'ticket_ids': ','.join(map(str, ticket_ids))}).get_json()['txid']
+    db.execute("UPDATE payment SET expires_at = datetime('now', '-1 minute')")  # cobrança venceu, reserva não
+    db.commit()
+
+    provider.delay = 0.3
+    results = []
+
+    def retry():
+        results.append(client.post(f'/retry_payment/{ticket_ids[0]}').get_json())
+
+    threads = [threading.Thread(target=retry) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(provider.charges) == 2  # a compra original e uma única nova cobrança
+    assert results[0]['txid'] == results[1]['txid'] != old_txid
+    old = db.execute('SELECT amount, ticket_count FROM payment WHERE txid = ?', (old_txid,)).fetchone()
+    assert (old['amount'], old['ticket_count']) == (4, 2)
+
+
+def test_retry_after_expiry_charges_every_pending_ticket_of_the_payment(app, db, provider):
+    raffle_id = create_raffle(db)
+    client = login(app.test_client())
+    client.post(f'/raffle/{raffle_id}/buy', data={'numbers': ['1', '2', '3']})
+    ticket_ids = [row['id'] for row in db.execute('SELECT id FROM ticket ORDER BY id')]
+    client.post('/create_pix_payment', data={'ticket_ids': ','.join(map(str, ticket_ids))})
+    db.execute("UPDATE payment SET expires_at = datetime('now', '-1 minute')")
+    db.commit()
+
+    new_txid = client.post(f'/retry_payment/{ticket_ids[1]}').get_json()['txid']
+
+    payment = db.execute('SELECT amount, ticket_count FROM payment WHERE txid = ?', (new_txid,)).fetchone()
+    assert (payment['amount'], payment['ticket_count']) == (6, 3)
+    linked = db.execute('SELECT COUNT(*) FROM ticket WHERE payment_txid = ?', (new_txid,)).fetchone()[0]
+    assert linked == 3
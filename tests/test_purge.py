@@ -0,0 +1,103 @@
+import pytest
+
+import purge
+
+
+def create_raffle(db, numbers=(1, 2)):
+    raffle_id = db.execute("INSERT INTO raffle (title, price, total_numbers) VALUES ('R', 2, 100)").lastrowid
+    for number in numbers:
+        db.execute(
+            "INSERT INTO ticket (user_id, raffle_id, number, status, payment_status, payment_txid) VALUES (1, ?, ?, 'paid', 'paid', ?)",
+            (raffle_id, number, f'TX{raffle_id}')
+        )
+    db.execute(
+        "INSERT INTO payment (txid, user_id, raffle_id, amount, type, status) VALUES (?, 1, ?, 4, 'manual', 'paid')",
+        (f'TX{raffle_id}', raffle_id)
+    )
+    db.commit()
+    return raffle_id
+
+
+def count(db, table):
+    return db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_purge_deletes_only_the_marked_raffle(db):
+    doomed = create_raffle(db)
+    kept = create_raffle(db)
+
+    job_id = purge.enqueue_purge(db, doomed)
+    assert purge.process_purge_jobs(batch_size=1, pause=0, vacuum='none') == 1
+
+    assert [row['id'] for row in db.execute('SELECT id FROM raffle')] == [kept]
+    assert count(db, 'ticket') == 2 and count(db, 'payment') == 1
+    job = db.execute('SELECT * FROM purge_job WHERE id = ?', (job_id,)).fetchone()
+    assert job['status'] == 'done' and job['tickets_deleted'] == 2 and job['payments_deleted'] == 1
+
+
+def test_delete_all_also_clears_payments_without_raffle(db):
+    create_raffle(db)
+    db.execute("INSERT INTO payment (txid, user_id, raffle_id, amount, type, status) VALUES ('ORPHAN', 1, 999, 2, 'manual', 'paid')")
+    db.commit()
+
+    purge.enqueue_purge(db)
+    purge.process_purge_jobs(pause=0, vacuum='none')
+
+    assert count(db, 'raffle') == 0 and count(db, 'ticket') == 0 and count(db, 'payment') == 0
+
+
+def test_failed_job_is_retried_then_parked_until_asked(db):
+    raffle_id = create_raffle(db)
+    job_id = purge.enqueue_purge(db, raffle_id)
+    db.execute('ALTER TABLE raffle_draw RENAME TO raffle_draw_off')  # primeiro passo falha
+
+    def job():
+        return db.execute('SELECT status, attempts, retry_at FROM purge_job WHERE id = ?', (job_id,)).fetchone()
+
+    with pytest.raises(Exception):
+        purge.process_purge_jobs(pause=0, vacuum='none', max_attempts=2, retry_backoff=0)
+    assert job()['status'] == 'pending' and job()['attempts'] == 1 and job()['retry_at']
+
+    with pytest.raises(Exception):
+        purge.process_purge_jobs(pause=0, vacuum='none', max_attempts=2, retry_backoff=0)
+    assert job()['status'] == 'failed'
+    assert purge.process_purge_jobs(pause=0, vacuum='none') == 0  # não é retomado sozinho
+
+    db.execute('ALTER TABLE raffle_draw_off RENAME TO raffle_draw')
+    assert purge.retry_failed_jobs(db) == 1
+    assert purge.process_purge_jobs(pause=0, vacuum='none') == 1
+    assert job()['status'] == 'done'
+    assert count(db, 'raffle') == 0
+
+
+def test_retry_waits_for_the_backoff(db):
+    job_id = purge.enqueue_purge(db, create_raffle(db))
+    db.execute('ALTER TABLE raffle_draw RENAME TO raffle_draw_off')
+    with pytest.raises(Exception):
+        purge.process_purge_jobs(pause=0, vacuum='none', retry_backoff=60)
+    db.execute('ALTER TABLE raffle_draw_off RENAME TO raffle_draw')
+
+    assert purge.process_purge_jobs(pause=0, vacuum='none') == 0
+    assert db.execute('SELECT status FROM purge_job WHERE id = ?', (job_id,)).fetchone()['status'] == 'pending'
+
+
+def test_cli_retry_failed(app, db):
+    job_id = purge.enqueue_purge(db, create_raffle(db))
+    db.execute("UPDATE purge_job SET status = 'failed', attempts = 5 WHERE id = ?", (job_id,))
+    db.commit()
+
+    result = app.test_cli_runner().invoke(args=['purge-raffles', '--retry-failed', '--vacuum', 'none'])
+
+    assert '1 exclusões com falha de volta na fila.' in result.output
+    assert '1 exclusões concluídas.' in result.output
+
+
+def test_raffle_being_deleted_is_hidden_from_the_grid(app, db):
+    raffle_id = create_raffle(db)
+    db.execute("UPDATE raffle SET status = 'deleting' WHERE id = ?", (raffle_id,))
+    db.commit()
+    client = app.test_client()
+
+    assert client.get(f'/raffle/{raffle_id}').status_code == 404
+    assert client.get(f'/raffle/{raffle_id}/numbers').status_code == 404
+    assert client.get(f'/raffle/{raffle_id}/numbers/map').status_code == 404
@@ -0,0 +1,131 @@
+"""
+Fila durável do webhook da Efí
+O webhook só valida e grava cada notificação PIX (idempotente por endToEndId/txid)
+e responde na hora; o job de fundo confirma os pagamentos em lotes.
+"""
+import json
+
+import click
+
+import background
+import database
+import payment_events
+import payments
+
+JOB_NAME = 'drain-webhook-inbox'
+
+
+def enqueue(db, pix_entries):
+    """Grava as notificações na fila (reenvios são ignorados); retorna quantas eram novas"""
+    rows = []
+    for pix in pix_entries:
+        txid = pix.get('txid')
+        event_key = pix.get('endToEndId') or (f'txid:{txid}' if txid else None)
+        if event_key:
+            rows.append((event_key, txid, json.dumps(pix)))
+
+    if not rows:
+        return 0
+
+    with database.immediate_transaction(db):
+        before = db.total_changes
+        db.executemany('''
+            INSERT OR IGNORE INTO webhook_inbox (event_key, txid, payload)
+            VALUES (?, ?, ?)
+        ''', rows)
+        return db.total_changes - before
+
+
+def wake_worker():
+    """Antecipa o processamento da fila neste worker"""
+    job = background.get_job(JOB_NAME)
+    if job:
+        job.wake()
+
+
+def drain_inbox(batch_size=100, max_batches=None, max_attempts=5):
+    """
+    Processa as notificações pendentes em lotes (uma transação por lote).
+    Uma notificação com erro não derruba o lote: volta para a fila até `max_attempts`.
+    Retorna quantas notificações foram concluídas.
+    """
+    db = database.get_db()
+    done_total = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        done = []
+        failed = []
+
+        with database.immediate_transaction(db):
+            # Lido dentro do lock de escrita: dois workers não pegam o mesmo lote
+            rows = db.execute('''
+                SELECT id, txid FROM webhook_inbox
+                WHERE status = 'pending'
+                ORDER BY id
+                LIMIT ?
+            ''', (batch_size,)).fetchall()
+
+            for row in rows:
+                db.execute('SAVEPOINT inbox_entry')
+                try:
+                    if row['txid']:
+                        payments.process_successful_payment(row['txid'], db)
+                    db.execute('RELEASE inbox_entry')
+                    done.append((row['id'],))
+                except Exception as e:
+                    db.execute('ROLLBACK TO inbox_entry')
+                    db.execute('RELEASE inbox_entry')
+                    failed.append((max_attempts, str(e), row['id']))
+
+            db.executemany('''
+                UPDATE webhook_inbox SET status = 'done', processed_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', done)
+            db.executemany('''
+                UPDATE webhook_inbox
+                SET attempts = attempts + 1, error = ?2,
+                    status = CASE WHEN attempts + 1 >= ?1 THEN 'failed' ELSE 'pending' END
+                WHERE id = ?3
+            ''', failed)
+
+        if done:
+            payment_events.notify()
+
+        done_total += len(done)
+        batches += 1
+        if len(rows) < batch_size or failed:
+            break  # fila vazia (ou só restam entradas com erro: tentar no próximo ciclo)
+
+    return done_total
+
+
+def purge_processed(retention_days=7, batch_size=1000):
+    """Remove notificações concluídas antigas (um lote por chamada)"""
+    db = database.get_db()
+    with database.immediate_transaction(db):
+        cursor = db.execute('''
+            DELETE FROM webhook_inbox WHERE id IN (
+                SELECT id FROM webhook_inbox
+                WHERE status = 'done' AND processed_at < datetime('now', ?)
+                LIMIT ?
+            )
+        ''', (f'-{int(retention_days)} days', batch_size))
+    return cursor.rowcount
+
+
+def init_app(app):
+    def drain():
+        drain_inbox(
+            batch_size=app.config['WEBHOOK_INBOX_BATCH'],
+            max_batches=app.config['WEBHOOK_INBOX_MAX_BATCHES']
+        )
+        purge_processed(retention_days=app.config['WEBHOOK_INBOX_RETENTION_DAYS'])
+
+    background.register_job(app, JOB_NAME, app.config['WEBHOOK_INBOX_INTERVAL'], drain)
+
+    @app.cli.command('drain-webhook-inbox')
+    @click.option('--batch-size', default=100, show_default=True)
+    def drain_webhook_inbox_command(batch_size):
+        """Processa agora todas as notificações pendentes do webhook."""
+        done = drain_inbox(batch_size=batch_size)
+        print(f'{done} notificações processadas.')